@@ -0,0 +1,160 @@
+from typing import Dict, Iterable, List, Optional
+from datetime import datetime
+import math
+
+
+# Relative width of a latency bucket; percentiles are accurate to about half of this
+SKETCH_ACCURACY = 0.02
+# Percentiles reported for every distribution
+PERCENTILES = (50, 90, 95, 99)
+
+
+class LatencySketch:
+    """
+    Streaming percentiles in bounded memory: values are counted in
+    logarithmic buckets, so one second and one hour each need only a few
+    hundred buckets whatever the number of samples.
+    """
+
+    def __init__(self, accuracy: float = SKETCH_ACCURACY):
+        self.log_base = math.log1p(accuracy)
+        self.buckets: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.ceil(math.log(value) / self.log_base)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def percentile(self, p: float) -> float:
+        rank = p / 100 * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket, and never above the largest value seen
+                return min(2 * math.exp(index * self.log_base) / (1 + math.exp(self.log_base)), self.max)
+        return self.max
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        if not self.count:
+            return None
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 3),
+            **{f"p{p}": round(self.percentile(p), 3) for p in PERCENTILES},
+            "max": round(self.max, 3),
+        }
+
+
+class CountDistribution:
+    """How many sessions have each message count, updated as counts change."""
+
+    def __init__(self):
+        self.sessions_with: Dict[int, int] = {}
+        self.total = 0
+        self.sessions = 0
+
+    def move(self, previous: int, current: int):
+        """A session went from `previous` messages (0 for a new one) to `current`."""
+        if previous:
+            self.sessions_with[previous] -= 1
+            if not self.sessions_with[previous]:
+                del self.sessions_with[previous]
+        else:
+            self.sessions += 1
+        self.sessions_with[current] = self.sessions_with.get(current, 0) + 1
+        self.total += current - previous
+
+    def summary(self) -> Optional[Dict[str, float]]:
+        if not self.sessions:
+            return None
+        counts = sorted(self.sessions_with)
+        result = {"count": self.sessions, "mean": round(self.total / self.sessions, 3)}
+        for p in PERCENTILES:
+            rank = p / 100 * (self.sessions - 1)
+            seen = 0
+            for count in counts:
+                seen += self.sessions_with[count]
+                if rank < seen:
+                    result[f"p{p}"] = count
+                    break
+        result["max"] = counts[-1]
+        return result
+
+
+class SessionAnalytics:
+    """
+    Study statistics kept up to date message by message, so a query never
+    rescans the stored transcripts:
+    - wizard response time: a user message to the next wizard/assistant
+      message of the same session (from the first user message still
+      unanswered, i.e. how long the user waited);
+    - messages per session.
+
+    Messages are identified by their seq, so one seen twice (replayed from
+    the database and also delivered by the broker) is counted once.
+    """
+
+    def __init__(self, wizard_roles: Iterable[str]):
+        self.wizard_roles = set(wizard_roles)
+        self.response_times = LatencySketch()
+        self.messages_per_session = CountDistribution()
+        # session_id -> last seq counted
+        self.last_seq: Dict[str, int] = {}
+        # session_id -> time of its first user message the wizard hasn't answered yet
+        self.waiting_since: Dict[str, datetime] = {}
+        self.roles: Dict[str, int] = {}
+
+    def record(self, session_id: str, message: dict) -> bool:
+        """Counts a message, given in seq order within its session; False if it was already counted."""
+        last_seq = self.last_seq.get(session_id, 0)
+        if message["seq"] <= last_seq:
+            return False
+        self.messages_per_session.move(last_seq, message["seq"])
+        self.last_seq[session_id] = message["seq"]
+        self.roles[message["role"]] = self.roles.get(message["role"], 0) + 1
+
+        if message["role"] == "user":
+            self.waiting_since.setdefault(session_id, datetime.fromisoformat(message["timestamp"]))
+        elif message["role"] in self.wizard_roles:
+            asked_at = self.waiting_since.pop(session_id, None)
+            if asked_at is not None:
+                waited = (datetime.fromisoformat(message["timestamp"]) - asked_at).total_seconds()
+                self.response_times.add(max(waited, 0.0))
+        return True
+
+    def record_many(self, rows: Iterable[tuple]):
+        """Replays stored (session_id, seq, role, text, timestamp) rows in session/seq order."""
+        for session_id, seq, role, text, timestamp in rows:
+            self.record(session_id, {"seq": seq, "role": role, "text": text, "timestamp": timestamp})
+
+    def summary(self) -> dict:
+        return {
+            "sessions": len(self.last_seq),
+            "messages": self.messages_per_session.total,
+            "messages_by_role": dict(sorted(self.roles.items())),
+            "waiting_for_wizard": len(self.waiting_since),
+            "wizard_response_seconds": self.response_times.summary(),
+            "messages_per_session": self.messages_per_session.summary(),
+        }
+
+
+def usage_by_task(items: Iterable[Dict], usage: Dict[str, int]) -> List[Dict]:
+    """Times the frequent responses of each task were sent, most used first."""
+    by_task: Dict[str, Dict] = {}
+    for item in items:
+        task = by_task.setdefault(item["taskClassification"], {"task": item["taskClassification"], "sent": 0, "responses": 0})
+        task["sent"] += usage.get(item["id"], 0)
+        task["responses"] += 1
+    return sorted(by_task.values(), key=lambda task: (-task["sent"], task["task"]))
@@ -0,0 +1,68 @@
+from typing import List
+import json
+import logging
+import queue
+import threading
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# Structured UI events, one JSON object per line
+EVENTS_FILE = Path("events.jsonl")
+# Most events written in one batch
+EVENT_BATCH_SIZE = 500
+# Seconds between flushes while events keep arriving
+EVENT_FLUSH_INTERVAL = 1.0
+
+
+class EventLogWriter:
+    """
+    Appends events to a JSONL file from a background thread. Callers on
+    the event loop only enqueue the event dict; serialization, writes and
+    flushes happen in batches on the writer thread.
+    """
+
+    def __init__(self, path: Path = EVENTS_FILE):
+        self.path = path
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="event-log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, event: dict):
+        self.queue.put(event)
+
+    def write_many(self, events: List[dict]):
+        for event in events:
+            self.queue.put(event)
+
+    def next_batch(self) -> List[dict]:
+        try:
+            batch = [self.queue.get(timeout=EVENT_FLUSH_INTERVAL)]
+        except queue.Empty:
+            return []
+        while len(batch) < EVENT_BATCH_SIZE:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        with open(self.path, "a", encoding="utf-8") as f:
+            while True:
+                batch = self.next_batch()
+                if batch:
+                    try:
+                        f.write("".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch))
+                        f.flush()
+                    except Exception as e:
+                        logger.error(f"Error writing {len(batch)} events: {str(e)}")
+                elif self.stopping.is_set():
+                    break
+
+    def close(self):
+        """Writes out whatever is still queued, then stops the writer thread."""
+        self.stopping.set()
+        self.thread.join()
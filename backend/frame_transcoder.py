@@ -0,0 +1,157 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import io
+import logging
+import os
+import time
+from metrics import TrafficMeter
+
+try:
+    from PIL import Image
+except ImportError:
+    # Optional: without Pillow every frame is relayed exactly as the phone sent it
+    Image = None
+
+
+logger = logging.getLogger(__name__)
+
+# (longest side in pixels, JPEG quality), best first. Adaptive viewers move along this ladder.
+QUALITY_LEVELS: Tuple[Tuple[int, int], ...] = ((1600, 85), (1280, 80), (960, 70), (720, 60), (480, 50))
+# Bounds for the size and quality a wizard may ask for
+MIN_FRAME_SIDE = 240
+MAX_FRAME_SIDE = 4096
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+# Threads decoding, resizing and encoding frames. Pillow releases the GIL while it does, so threads run in parallel.
+TRANSCODE_WORKERS = min(4, os.cpu_count() or 1)
+# Seconds of traffic an adaptive viewer's level is judged on
+ADAPT_INTERVAL = 2.0
+# Share of ADAPT_INTERVAL spent in sends above which an adaptive viewer goes one level down...
+BUSY_HIGH = 0.5
+# ...and below which (with no dropped frames) it goes one level back up
+BUSY_LOW = 0.1
+
+available = Image is not None
+# Threads are only started once frames are submitted
+pool = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+
+
+def transcode(data: bytes, max_side: int, quality: int) -> bytes:
+    """
+    Re-encodes an image as JPEG at `quality`, scaled down so that its longest
+    side is at most `max_side`. Returns `data` itself if it isn't an image
+    Pillow can read, or if the result wouldn't be smaller.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        scale = min(max_side / max(image.size), 1.0)
+        size = (max(round(image.width * scale), 1), max(round(image.height * scale), 1))
+        # JPEG sources are decoded directly at 1/2, 1/4 or 1/8 scale when that is still large enough
+        image.draft("RGB", size)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=quality)
+    except Exception:
+        return data
+    encoded = output.getvalue()
+    return encoded if len(encoded) < len(data) else data
+
+
+def timed_transcode(data: bytes, max_side: int, quality: int) -> Tuple[bytes, float]:
+    """transcode(), plus the CPU seconds it took on its thread."""
+    started = time.thread_time()
+    encoded = transcode(data, max_side, quality)
+    return encoded, time.thread_time() - started
+
+
+class ViewerQuality:
+    """
+    Size and JPEG quality that frames are re-encoded to for one wizard viewer.
+    A fixed setting stays as picked on connect. An adaptive one starts there
+    and steps down QUALITY_LEVELS while the viewer can't keep up: frames are
+    dropped from its queue, or sends block for more than BUSY_HIGH of the
+    time. Once sends are quick again it steps back up, but never above the
+    setting picked on connect.
+    """
+
+    def __init__(self, max_side: int, quality: int, adaptive: bool = False):
+        self.adaptive = adaptive
+        self.levels: List[Tuple[int, int]] = [(max_side, quality)]
+        if adaptive:
+            self.levels += [level for level in QUALITY_LEVELS if level[0] < max_side]
+        self.level = 0
+        self.frames = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.cpu_seconds = 0.0
+        # Traffic totals when the level was last judged
+        self.checked_at = time.monotonic()
+        self.checked_send_seconds = 0.0
+        self.checked_dropped = 0
+
+    @property
+    def setting(self) -> Tuple[int, int]:
+        return self.levels[self.level]
+
+    async def transcode(self, data: bytes) -> Tuple[bytes, float]:
+        """Re-encodes a frame on the transcoding pool; returns it with the CPU seconds spent."""
+        max_side, quality = self.setting
+        encoded, cpu_seconds = await asyncio.get_running_loop().run_in_executor(pool, timed_transcode, data, max_side, quality)
+        self.frames += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(encoded)
+        self.cpu_seconds += cpu_seconds
+        return encoded, cpu_seconds
+
+    def adapt(self, meter: TrafficMeter, dropped: int, target_id: str):
+        """Judges the viewer's traffic since the last check, every ADAPT_INTERVAL seconds."""
+        now = time.monotonic()
+        if not self.adaptive or now - self.checked_at < ADAPT_INTERVAL:
+            return
+        busy = (meter.send_seconds - self.checked_send_seconds) / (now - self.checked_at)
+        newly_dropped = dropped - self.checked_dropped
+        self.checked_at, self.checked_send_seconds, self.checked_dropped = now, meter.send_seconds, dropped
+
+        if (newly_dropped or busy > BUSY_HIGH) and self.level < len(self.levels) - 1:
+            self.level += 1
+        elif not newly_dropped and busy < BUSY_LOW and self.level > 0:
+            self.level -= 1
+        else:
+            return
+        max_side, quality = self.setting
+        logger.info(f"Frames to {target_id} now {max_side}px at quality {quality} (busy {busy:.0%}, {newly_dropped} dropped)")
+
+    def stats(self) -> Dict:
+        max_side, quality = self.setting
+        return {
+            "size": max_side,
+            "quality": quality,
+            "adaptive": self.adaptive,
+            "frames": self.frames,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "cpu_ms_per_frame": round(self.cpu_seconds / self.frames * 1000, 2) if self.frames else None,
+        }
+
+
+def requested_quality(size: int, quality: int, adaptive: bool) -> Optional[ViewerQuality]:
+    """
+    The setting a wizard asked for on connect (0 means the best level), or
+    None to relay frames untouched: when nothing was asked for, or Pillow
+    isn't installed.
+    """
+    if not (size or quality or adaptive):
+        return None
+    if not available:
+        logger.warning("Frame transcoding requested but Pillow is not installed; relaying frames unchanged")
+        return None
+    best_side, best_quality = QUALITY_LEVELS[0]
+    return ViewerQuality(
+        min(max(size or best_side, MIN_FRAME_SIDE), MAX_FRAME_SIDE),
+        min(max(quality or best_quality, MIN_QUALITY), MAX_QUALITY),
+        adaptive
+    )
@@ -1,11 +1,14 @@
 from typing import List, Dict
+import bisect
 import uuid
 import logging
-import json
-import os
 from pathlib import Path
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
+from journal_store import JournaledStore
+from pubsub import broker
+from response_cache import ResponseCache, make_etag
+from response_search import ResponseSearchIndex
 
 
 logger = logging.getLogger(__name__)
@@ -14,67 +17,22 @@ router = APIRouter(prefix="/frequentResponse", tags=["frequentResponse"])
 # JSON 파일 경로
 DATA_FILE = Path("frequent_responses.json")
 TASK_CLASSIFICATIONS_FILE = Path("task_classifications.json")
-def load_task_classifications() -> List[Dict[str, str]]:
-    """파일에서 task classifications를 로드합니다."""
-    if TASK_CLASSIFICATIONS_FILE.exists():
-        try:
-            with open(TASK_CLASSIFICATIONS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                logger.info(f"Loaded {len(data)} task classifications from disk")
-                return data
-        except Exception as e:
-            logger.error(f"Error loading task classifications: {e}")
-            return get_default_task_classifications()
-    else:
-        # 파일이 없으면 기본값으로 초기화
-        default_data = get_default_task_classifications()
-        save_task_classifications(default_data)
-        return default_data
-
+# 여러 worker가 동시에 처음 시작해도 기본값의 id가 같도록 내용에서 id를 만듭니다
 def get_default_task_classifications() -> List[Dict[str, str]]:
     """기본 task classifications를 반환합니다."""
     return [
         {
-            "id": str(uuid.uuid4()),
+            "id": str(uuid.uuid5(uuid.NAMESPACE_OID, "taskClassification:Open Naver")),
             "name": "Open Naver",
         }
     ]
 
-def save_task_classifications(data: List[Dict[str, str]]):
-    """task classifications를 파일에 저장합니다."""
-    try:
-        with open(TASK_CLASSIFICATIONS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(data)} task classifications to disk")
-    except Exception as e:
-        logger.error(f"Error saving task classifications: {e}")
-        raise
-
-task_classifications: List[Dict[str, str]] = load_task_classifications()
-
-def load_responses() -> List[Dict[str, str]]:
-    """파일에서 frequent responses를 로드합니다."""
-    if DATA_FILE.exists():
-        try:
-            with open(DATA_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                logger.info(f"Loaded {len(data)} frequent responses from disk")
-                return data
-        except Exception as e:
-            logger.error(f"Error loading frequent responses: {e}")
-            return get_default_responses()
-    else:
-        # 파일이 없으면 기본값으로 초기화
-        default_data = get_default_responses()
-        save_responses(default_data)
-        return default_data
-
 
 def get_default_responses() -> List[Dict[str, str]]:
     """기본 frequent responses를 반환합니다."""
     return [
         {
-            "id": str(uuid.uuid4()),
+            "id": str(uuid.uuid5(uuid.NAMESPACE_OID, "frequentResponse:Open Naver:0")),
             "taskClassification": "Open Naver",
             "content": "안녕하세요! 무엇을 도와드릴까요?",
             "order": 1
@@ -82,19 +40,172 @@ def get_default_responses() -> List[Dict[str, str]]:
     ]
 
 
-def save_responses(data: List[Dict[str, str]]):
-    """frequent responses를 파일에 저장합니다."""
-    try:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"Saved {len(data)} frequent responses to disk")
-    except Exception as e:
-        logger.error(f"Error saving frequent responses: {e}")
-        raise
+# 변경 사항은 저널에 추가되고, 스냅샷은 백그라운드에서 주기적으로 다시 씁니다
+task_classifications_store = JournaledStore(TASK_CLASSIFICATIONS_FILE)
+responses_store = JournaledStore(DATA_FILE)
+
+
+class FrequentResponseIndex:
+    """
+    id → 항목 해시 인덱스와 task별 순서 목록으로 frequent responses를 관리합니다.
+    각 항목의 order는 해당 task 목록 안에서의 위치(0부터)와 항상 같으므로,
+    조회는 O(1)이고 순서 변경은 해당 task의 항목 수만큼만 비용이 듭니다.
+    """
+
+    def __init__(self, items: List[Dict], store: JournaledStore):
+        self.store = store
+        self.by_id: Dict[str, Dict] = {item["id"]: item for item in items}
+        self.by_task: Dict[str, List[Dict]] = {}
+        for item in sorted(items, key=lambda item: item.get("order") or 0):
+            self.by_task.setdefault(item["taskClassification"], []).append(item)
+        # Older files may have gaps or duplicates in order; make it match the position
+        for responses in self.by_task.values():
+            self.renumber(responses)
+
+    def all(self) -> List[Dict]:
+        return list(self.by_id.values())
+
+    def for_task(self, task: str) -> List[Dict]:
+        return list(self.by_task.get(task, []))
+
+    def get(self, id: str) -> Dict | None:
+        return self.by_id.get(id)
+
+    def renumber(self, responses: List[Dict], start: int = 0, end: int | None = None):
+        """responses[start:end]의 order를 위치에 맞게 고치고, 바뀐 항목만 저장합니다."""
+        for position in range(start, len(responses) if end is None else end):
+            if responses[position].get("order") != position:
+                responses[position]["order"] = position
+                self.store.put(responses[position])
+
+    @staticmethod
+    def position(responses: List[Dict], item: Dict) -> int:
+        """
+        목록에서 item의 위치를 찾습니다. 보통은 order와 같지만, 다른 worker의 변경이
+        차례로 도착하는 동안에는 order가 겹치거나 비어 있을 수 있어 객체로 찾습니다.
+        """
+        order = item.get("order")
+        if isinstance(order, int) and 0 <= order < len(responses) and responses[order] is item:
+            return order
+        return next(position for position, response in enumerate(responses) if response is item)
+
+    def insert(self, item: Dict, order: int | None):
+        responses = self.by_task.setdefault(item["taskClassification"], [])
+        position = len(responses) if order is None else min(max(order, 0), len(responses))
+        responses.insert(position, item)
+        item["order"] = None
+        self.renumber(responses, position)
+
+    def remove(self, item: Dict):
+        responses = self.by_task[item["taskClassification"]]
+        position = self.position(responses, item)
+        responses.pop(position)
+        if not responses:
+            del self.by_task[item["taskClassification"]]
+        else:
+            self.renumber(responses, position)
+
+    def add(self, task: str, content: str, order: int | None = None) -> Dict:
+        item = {
+            "id": str(uuid.uuid4()),
+            "taskClassification": task,
+            "content": content,
+            "order": None
+        }
+        self.by_id[item["id"]] = item
+        self.insert(item, order)
+        return item
+
+    def update(self, item: Dict, task: str, content: str, order: int | None = None):
+        if task != item["taskClassification"]:
+            self.remove(item)
+            item["taskClassification"] = task
+            self.insert(item, order)
+        elif order is not None:
+            responses = self.by_task[task]
+            previous = self.position(responses, item)
+            current = min(max(order, 0), len(responses) - 1)
+            responses.insert(current, responses.pop(previous))
+            self.renumber(responses, min(previous, current), max(previous, current) + 1)
+        item["content"] = content
+        self.store.put(item)
+
+    def delete(self, item: Dict):
+        self.remove(item)
+        del self.by_id[item["id"]]
+        self.store.delete(item["id"])
+
+    def reorder(self, task: str, ids: List[str]):
+        """task의 전체 순서를 ids 순서로 한 번에 바꿉니다."""
+        responses = self.by_task.get(task, [])
+        if len(ids) != len(responses) or set(ids) != {item["id"] for item in responses}:
+            raise ValueError("ids must list every response of the task exactly once")
+        responses[:] = [self.by_id[id] for id in ids]
+        self.renumber(responses)
+
+    def detach(self, item: Dict):
+        responses = self.by_task[item["taskClassification"]]
+        responses.remove(item)
+        if not responses:
+            del self.by_task[item["taskClassification"]]
+
+    def apply_remote(self, entry: Dict):
+        """
+        다른 worker가 저장한 변경을 반영합니다. 다시 저장하지 않으므로 renumber 대신
+        order 순서 자리에 끼워 넣고, 여러 항목에 걸친 변경은 차례로 도착하며 맞춰집니다.
+        """
+        if entry["op"] == "delete":
+            item = self.by_id.pop(entry["id"], None)
+            if item is not None:
+                self.detach(item)
+            return
+        item = self.by_id.get(entry["item"]["id"])
+        if item is None:
+            item = self.by_id[entry["item"]["id"]] = {}
+        else:
+            self.detach(item)
+        item.update(entry["item"])
+        responses = self.by_task.setdefault(item["taskClassification"], [])
+        bisect.insort(responses, item, key=lambda response: response["order"])
+
+
+def apply_remote_task_classification(entry: Dict):
+    id = entry["id"] if entry["op"] == "delete" else entry["item"]["id"]
+    position = next((idx for idx, item in enumerate(task_classifications) if item["id"] == id), None)
+    if entry["op"] == "delete":
+        if position is not None:
+            task_classifications.pop(position)
+    elif position is None:
+        task_classifications.append(entry["item"])
+    else:
+        task_classifications[position].update(entry["item"])
+
+
+def apply_remote_response(entry: Dict):
+    frequent_responses.apply_remote(entry)
+    if entry["op"] == "delete":
+        response_search.remove(entry["id"])
+    else:
+        response_search.update(frequent_responses.get(entry["item"]["id"]))
+
 
+# 여러 worker가 같은 파일에 쓰지 않도록 변경 사항은 broker로 주고받고, 파일은 hub만 씁니다
+task_classifications_store.replicate(broker, "taskClassifications", apply_remote_task_classification)
+responses_store.replicate(broker, "frequentResponses", apply_remote_response)
 
-# 서버 시작 시 파일에서 로드
-frequent_responses: List[Dict[str, str]] = load_responses()
+
+# 서버 시작 시 스냅샷 + 저널에서 로드
+task_classifications: List[Dict[str, str]] = task_classifications_store.load(get_default_task_classifications)
+frequent_responses = FrequentResponseIndex(responses_store.load(get_default_responses), responses_store)
+response_search = ResponseSearchIndex(frequent_responses.all())
+# 목록 조회 응답은 저장소 버전이 바뀔 때까지 직렬화된 본문을 재사용합니다
+read_cache = ResponseCache()
+
+
+@router.on_event("shutdown")
+def flush_frequent_responses():
+    task_classifications_store.close()
+    responses_store.close()
 
 
 class FrequentResponse(BaseModel):
@@ -109,77 +220,70 @@ class FrequentResponseCreate(BaseModel):
     content: str
     order : int | None = None
 
-def find_frequent_response(id: str) -> Dict[str, str]:
-    for item in frequent_responses:
-        if item["id"] == id:
-            return item
-    return None
+class FrequentResponseOrder(BaseModel):
+    taskClassification: str
+    ids: List[str]
 
 @router.get("", response_model=List[FrequentResponse])
-async def list_frequent_responses():
-    return frequent_responses
+async def list_frequent_responses(request: Request, task: str | None = None):
+    # `task is None` first, so ?task=None can't share the unfiltered list's key
+    etag = make_etag("frequentResponse", responses_store.version, task is None, task)
+    if task is not None:
+        return read_cache.json(request, etag, lambda: frequent_responses.for_task(task))
+    return read_cache.json(request, etag, frequent_responses.all)
+
+
+@router.get("/search", response_model=List[FrequentResponse])
+async def search_frequent_responses(q: str, limit: int = 20, task: str | None = None):
+    """
+    입력 중인 검색어로 frequent responses를 찾습니다.
+    '안녕', '안녀', 'ㅇㄴ'처럼 음절, 자모, 초성 단위의 부분 입력을 모두 지원하고
+    일치 정도와 실제 전송 횟수 순으로 정렬합니다.
+    """
+    return response_search.search(q, min(max(limit, 1), 100), task)
 
 
 @router.post("", response_model=FrequentResponse, status_code=201)
 async def add_frequent_response(request: FrequentResponseCreate):
-    sameTaskResponse = [r for r in frequent_responses if r["taskClassification"] == request.taskClassification];
-    if request.order != None:
-        for response in sameTaskResponse:
-            if response["order"] >= request.order:
-                response["order"] += 1;
-    new_item = {
-        "id": str(uuid.uuid4()),
-        "taskClassification": request.taskClassification,
-        "content": request.content,
-        "order": request.order if request.order else len(sameTaskResponse)
-    }
-    frequent_responses.append(new_item)
-    save_responses(frequent_responses)
+    new_item = frequent_responses.add(request.taskClassification, request.content, request.order)
+    response_search.add(new_item)
     logger.info(f"Frequent response added: {new_item}")
     return new_item
 
 
+@router.patch("/order", response_model=List[FrequentResponse])
+async def reorder_frequent_responses(request: FrequentResponseOrder):
+    try:
+        frequent_responses.reorder(request.taskClassification, request.ids)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response_search.invalidate_ranking()
+    logger.info(f"Frequent responses reordered: {request.taskClassification}")
+    return frequent_responses.for_task(request.taskClassification)
+
+
 @router.put("/{response_id}", response_model=FrequentResponse)
 async def update_frequent_response(response_id: str, request: FrequentResponseCreate):
-    print("update_frequent_response", response_id, request)
-    targetItem = find_frequent_response(response_id);
-    print("targetItem", targetItem)
+    targetItem = frequent_responses.get(response_id)
     if not targetItem:
         raise HTTPException(status_code=404, detail="Frequent response not found");
 
-    if request.order != None:
-        print("request.order", request.order)
-        previousOrder = targetItem["order"]
-        currentOrder = request.order
-        print("change status", previousOrder, currentOrder)
-        if previousOrder > currentOrder:
-            for response in frequent_responses:
-                if response["order"] < previousOrder and response["order"] >= currentOrder:
-                    response["order"] += 1;
-        elif previousOrder < currentOrder:
-            for response in frequent_responses:
-                if response["order"] > previousOrder and response["order"] <= currentOrder:
-                    response["order"] -= 1;
-
-    targetItem["taskClassification"] = request.taskClassification
-    targetItem["content"] = request.content
-    targetItem["order"] = request.order if request.order != None else targetItem["order"]
-    save_responses(frequent_responses)
+    frequent_responses.update(targetItem, request.taskClassification, request.content, request.order)
+    response_search.update(targetItem)
     logger.info(f"Frequent response updated: {targetItem}")
     return targetItem
 
 
 @router.delete("/{response_id}")
 async def delete_frequent_response(response_id: str):
-    for idx, item in enumerate(frequent_responses):
-        if item["id"] == response_id:
-            frequent_responses.pop(idx)
-            for i in range(idx, len(frequent_responses)):
-                frequent_responses[i]["order"] -= 1
-            save_responses(frequent_responses)
-            logger.info(f"Frequent response deleted: {response_id}")
-            return {"status": "deleted", "id": response_id}
-    raise HTTPException(status_code=404, detail="Frequent response not found")
+    targetItem = frequent_responses.get(response_id)
+    if not targetItem:
+        raise HTTPException(status_code=404, detail="Frequent response not found")
+
+    frequent_responses.delete(targetItem)
+    response_search.remove(response_id)
+    logger.info(f"Frequent response deleted: {response_id}")
+    return {"status": "deleted", "id": response_id}
 
 
 class TaskClassification(BaseModel):
@@ -190,8 +294,9 @@ class TaskClassificationCreate(BaseModel):
     name: str
 
 @router.get("/taskClassifications", response_model=List[TaskClassification])
-async def list_task_classifications():
-    return task_classifications
+async def list_task_classifications(request: Request):
+    etag = make_etag("taskClassifications", task_classifications_store.version)
+    return read_cache.json(request, etag, lambda: task_classifications)
 
 @router.post("/taskClassifications", response_model=TaskClassification, status_code=201)
 async def add_task_classification(request: TaskClassificationCreate):
@@ -200,7 +305,7 @@ async def add_task_classification(request: TaskClassificationCreate):
         "name": request.name
     }
     task_classifications.append(new_item)
-    save_task_classifications(task_classifications)
+    task_classifications_store.put(new_item)
     logger.info(f"Task classification added: {new_item}")
     return new_item
 
@@ -209,7 +314,7 @@ async def update_task_classification(task_classification_id: str, request: TaskC
     for item in task_classifications:
         if item["id"] == task_classification_id:
             item["name"] = request.name
-            save_task_classifications(task_classifications)
+            task_classifications_store.put(item)
             logger.info(f"Task classification updated: {item}")
             return item
     raise HTTPException(status_code=404, detail="Task classification not found")
@@ -219,7 +324,7 @@ async def delete_task_classification(task_classification_id: str):
     for idx, item in enumerate(task_classifications):
         if item["id"] == task_classification_id:
             task_classifications.pop(idx)
-            save_task_classifications(task_classifications)
+            task_classifications_store.delete(task_classification_id)
             logger.info(f"Task classification deleted: {task_classification_id}")
             return {"status": "deleted", "id": task_classification_id}
     raise HTTPException(status_code=404, detail="Task classification not found")
\ No newline at end of file
@@ -0,0 +1,186 @@
+from typing import Callable, Dict, List, Optional
+import json
+import logging
+import os
+import queue
+import threading
+from pathlib import Path
+from pubsub import Broker
+
+
+logger = logging.getLogger(__name__)
+
+# 변경이 없는 상태로 이 시간(초)이 지나면 스냅샷을 새로 씁니다
+SNAPSHOT_DELAY = 2.0
+# 저널이 이만큼 쌓이면 변경이 계속되더라도 스냅샷을 씁니다
+MAX_JOURNAL_ENTRIES = 1000
+
+STOP = object()
+SNAPSHOT = object()
+
+
+class JournaledStore:
+    """
+    id를 가진 항목 목록을 스냅샷 파일과 추가 전용 저널로 저장합니다.
+    변경 사항은 백그라운드 스레드가 저널에 한 줄씩 추가하고,
+    연속된 변경이 잠잠해지면 스냅샷을 원자적으로 다시 쓴 뒤 저널을 비웁니다.
+
+    replicate()로 여러 프로세스가 같은 파일을 공유하면, 각 프로세스의 변경은
+    broker로 다른 프로세스에 전달되고 파일은 hub 프로세스만 씁니다.
+    """
+
+    def __init__(self, snapshot_path: Path):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path.with_suffix(".journal")
+        self.temp_path = snapshot_path.with_suffix(".tmp")
+        # Owned by the writer thread: the state the next snapshot is built from
+        self.state: Dict[str, dict] = {}
+        self.journal_entries = 0
+        # Bumped on every change; read endpoints derive their ETags from it
+        self.version = 0
+        # Only one process may write the files; the others just keep self.state current
+        self.persist = True
+        self.broker: Optional[Broker] = None
+        self.channel = ""
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self.run, name=f"journal-{snapshot_path.stem}", daemon=True)
+
+    def replicate(self, broker: Broker, channel: str, on_remote: Callable[[dict], None]):
+        """
+        변경 사항을 channel로 주고받습니다. 다른 프로세스의 변경은 on_remote로
+        호출자의 메모리 상태에 반영됩니다. load()보다 먼저 호출해야 합니다.
+        """
+        self.broker = broker
+        self.channel = channel
+        self.persist = broker.hub
+        broker.subscribe(channel, lambda payload: self.receive(payload, on_remote))
+        broker.hub_listeners.append(self.take_over)
+
+    def load(self, default_factory: Callable[[], List[dict]]) -> List[dict]:
+        """스냅샷과 저널을 읽어 현재 목록을 만들고 저장 스레드를 시작합니다."""
+        items = None
+        if self.snapshot_path.exists():
+            try:
+                with open(self.snapshot_path, "r", encoding="utf-8") as f:
+                    items = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading {self.snapshot_path}: {e}")
+
+        state = {item["id"]: item for item in items or []}
+        replayed = self.replay_journal(state)
+        if items is None and not replayed:
+            # 파일이 없으면 기본값으로 초기화
+            for item in default_factory():
+                state[item["id"]] = item
+                self.put(item)
+
+        self.state = {id: dict(item) for id, item in state.items()}
+        self.journal_entries = replayed
+        self.thread.start()
+        logger.info(f"Loaded {len(state)} items from {self.snapshot_path} (+{replayed} journal entries)")
+        return list(state.values())
+
+    def replay_journal(self, state: Dict[str, dict]) -> int:
+        if not self.journal_path.exists():
+            return 0
+        count = 0
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-append can only leave the last line incomplete
+                    logger.warning(f"Skipping incomplete journal entry in {self.journal_path}")
+                    break
+                self.apply(state, entry)
+                count += 1
+        return count
+
+    @staticmethod
+    def apply(state: Dict[str, dict], entry: dict):
+        if entry["op"] == "put":
+            state[entry["item"]["id"]] = entry["item"]
+        elif entry["op"] == "delete":
+            state.pop(entry["id"], None)
+
+    def put(self, item: dict):
+        """항목 추가/수정을 기록합니다. 호출 시점의 사본이 저장됩니다."""
+        self.record({"op": "put", "item": dict(item)})
+
+    def delete(self, id: str):
+        self.record({"op": "delete", "id": id})
+
+    def record(self, entry: dict):
+        self.version += 1
+        self.queue.put(entry)
+        if self.broker is not None:
+            self.broker.publish(self.channel, json.dumps({**entry, "origin": self.broker.node_id}, ensure_ascii=False).encode("utf-8"))
+
+    def receive(self, payload: bytes, on_remote: Callable[[dict], None]):
+        entry = json.loads(payload)
+        if entry.pop("origin") == self.broker.node_id:
+            return
+        self.version += 1
+        self.queue.put(entry)
+        on_remote(entry)
+
+    def take_over(self):
+        """이 프로세스가 hub가 되면 파일 쓰기를 맡고, 지금 상태로 스냅샷을 새로 씁니다."""
+        self.persist = True
+        self.queue.put(SNAPSHOT)
+
+    def close(self):
+        """남은 변경을 저널에 쓰고 스냅샷을 만든 뒤 저장 스레드를 멈춥니다."""
+        self.queue.put(STOP)
+        self.thread.join()
+
+    def run(self):
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            while True:
+                try:
+                    entry = self.queue.get(timeout=SNAPSHOT_DELAY)
+                except queue.Empty:
+                    # Quiet period after a burst of changes
+                    if self.persist and self.journal_entries:
+                        try:
+                            self.write_snapshot(journal)
+                        except Exception as e:
+                            logger.error(f"Error saving {self.snapshot_path}: {e}")
+                    continue
+
+                batch = [entry]
+                while True:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = STOP in batch
+                snapshot = SNAPSHOT in batch
+                batch = [entry for entry in batch if entry is not STOP and entry is not SNAPSHOT]
+
+                try:
+                    if batch:
+                        if self.persist:
+                            journal.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch))
+                            journal.flush()
+                            self.journal_entries += len(batch)
+                        for entry in batch:
+                            self.apply(self.state, entry)
+                    if self.persist and (snapshot or (self.journal_entries and (stopping or self.journal_entries >= MAX_JOURNAL_ENTRIES))):
+                        self.write_snapshot(journal)
+                except Exception as e:
+                    logger.error(f"Error saving {self.snapshot_path}: {e}")
+                if stopping:
+                    break
+
+    def write_snapshot(self, journal):
+        # Write-then-rename, so a crash leaves either the old or the new snapshot
+        with open(self.temp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self.state.values()), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.temp_path, self.snapshot_path)
+        # Replaying the old journal onto the new snapshot is harmless, so truncating last is safe
+        journal.truncate(0)
+        logger.info(f"Saved {len(self.state)} items to {self.snapshot_path} ({self.journal_entries} journal entries compacted)")
+        self.journal_entries = 0
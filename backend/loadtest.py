@@ -0,0 +1,566 @@
+# Load test for the WOZ backend: simulated phone/wizard pairs against a local server.
+#
+#   python loadtest.py --pairs 20 --fps 10 --frame-size 60000 --duration 30 --output results.json
+#   python loadtest.py --pairs 20 --workers 4 --baseline results.json
+#
+# Each pair streams frames phone → wizard, exchanges chat messages through
+# POST /message and sends /log events. Frames carry their send time, so the
+# wizard side measures relay latency directly. Results are written as JSON.
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+import websockets
+
+
+BACKEND_DIR = Path(__file__).resolve().parent
+# Prepended to every frame: send time (time.perf_counter) and frame number
+FRAME_HEADER = struct.Struct("<dI")
+# Seconds between server memory samples
+SAMPLE_INTERVAL = 1.0
+# Seconds to let connections settle before the phones start sending
+WARMUP = 1.0
+# Upper bound for the long-poll `wait` used by polling clients
+POLL_WAIT = 25
+# Relative change against --baseline that counts as a regression
+REGRESSION_THRESHOLD = 0.10
+# Metrics compared against --baseline: (path in the results, True if higher is better)
+BASELINE_METRICS = [
+    ("frames.received_per_second", True),
+    ("frames.latency_ms.p50", False),
+    ("frames.latency_ms.p95", False),
+    ("frames.latency_ms.p99", False),
+    ("chat.delivery_ms.p95", False),
+    ("chat.round_trip_ms.p50", False),
+    ("chat.round_trip_ms.p95", False),
+    ("http.POST /message.latency_ms.p95", False),
+    ("http.POST /log.latency_ms.p95", False),
+    ("memory.growth_mb", False),
+]
+
+
+class HttpClient:
+    """Minimal keep-alive HTTP/1.1 client, enough for the JSON endpoints of main.py."""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def request(self, method: str, path: str, body=None) -> Tuple[int, bytes]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n".encode("latin-1") + payload
+        )
+        try:
+            status = int((await self.reader.readline()).split()[1])
+            headers = {}
+            while True:
+                line = await self.reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            content = await self.reader.readexactly(int(headers.get("content-length", 0)))
+        except (IndexError, ValueError, asyncio.IncompleteReadError, ConnectionError):
+            await self.close()
+            raise ConnectionError(f"{method} {path}: connection closed")
+        if headers.get("connection") == "close":
+            await self.close()
+        return status, content
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+
+class PairRunner:
+    """Runs a slice of the simulated pairs in one process and collects raw samples."""
+
+    def __init__(self, config: dict, pair_ids: List[int]):
+        self.config = config
+        self.pair_ids = pair_ids
+        self.ws_url = config["url"].replace("http", "ws", 1)
+        host_port = config["url"].split("//", 1)[1]
+        self.host, _, port = host_port.partition(":")
+        self.port = int(port or 80)
+        self.samples = {
+            "frame_latencies": [],
+            "chat_delivery": [],
+            "chat_round_trips": [],
+            "http": {},
+        }
+        self.counters = {
+            "frames_sent": 0,
+            "frames_received": 0,
+            "frame_bytes_sent": 0,
+            "frame_bytes_received": 0,
+            "unchanged_received": 0,
+            "chat_sent": 0,
+            "chat_delivered": 0,
+            "chat_round_trips": 0,
+            "logs_sent": 0,
+            "errors": 0,
+        }
+
+    async def timed_request(self, client: HttpClient, route: str, method: str, path: str, body=None) -> Optional[bytes]:
+        started = time.perf_counter()
+        route_samples = self.samples["http"].setdefault(route, {"latencies": [], "errors": 0})
+        try:
+            status, content = await client.request(method, path, body)
+        except (OSError, ConnectionError):
+            route_samples["errors"] += 1
+            self.counters["errors"] += 1
+            return None
+        if status >= 400:
+            route_samples["errors"] += 1
+            self.counters["errors"] += 1
+            return None
+        route_samples["latencies"].append(time.perf_counter() - started)
+        return content
+
+    async def run(self) -> dict:
+        loop = asyncio.get_running_loop()
+        tasks = []
+        connections = []
+        try:
+            for pair in self.pair_ids:
+                session_id = f"{self.config['prefix']}-{pair}"
+                wizard = await websockets.connect(f"{self.ws_url}/ws/wizard/{session_id}", max_size=None)
+                connections.append(wizard)
+                tasks.append(asyncio.create_task(self.receive_frames(wizard)))
+                tasks.append(asyncio.create_task(self.follow_chat(session_id, "wizard")))
+                tasks.append(asyncio.create_task(self.follow_chat(session_id, "phone")))
+            await asyncio.sleep(WARMUP)
+
+            stop_at = loop.time() + self.config["duration"]
+            senders = []
+            for index, pair in enumerate(self.pair_ids):
+                session_id = f"{self.config['prefix']}-{pair}"
+                # Spread the pairs over one frame interval instead of sending in lockstep
+                offset = index / max(len(self.pair_ids), 1) / self.config["fps"]
+                senders.append(asyncio.create_task(self.send_frames(session_id, stop_at, offset)))
+                senders.append(asyncio.create_task(self.send_chat(session_id, stop_at)))
+                senders.append(asyncio.create_task(self.send_logs(session_id, stop_at)))
+            await asyncio.gather(*senders)
+            # Let in-flight frames and replies arrive
+            await asyncio.sleep(self.config["drain"])
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for connection in connections:
+                await connection.close()
+        return {"samples": self.samples, "counters": self.counters}
+
+    async def send_frames(self, session_id: str, stop_at: float, offset: float):
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.config["fps"]
+        padding = os.urandom(max(self.config["frame_size"] - FRAME_HEADER.size, 0))
+        await asyncio.sleep(offset)
+        try:
+            async with websockets.connect(f"{self.ws_url}/ws/phone/{session_id}", max_size=None) as phone:
+                number = 0
+                next_at = loop.time()
+                while loop.time() < stop_at:
+                    # A new header every frame, so the server never sees an unchanged screen
+                    frame = FRAME_HEADER.pack(time.perf_counter(), number) + padding
+                    await phone.send(frame)
+                    self.counters["frames_sent"] += 1
+                    self.counters["frame_bytes_sent"] += len(frame)
+                    number += 1
+                    next_at += interval
+                    await asyncio.sleep(max(next_at - loop.time(), 0))
+        except (OSError, websockets.ConnectionClosed):
+            self.counters["errors"] += 1
+
+    async def receive_frames(self, wizard):
+        try:
+            async for message in wizard:
+                if isinstance(message, bytes):
+                    sent_at, _ = FRAME_HEADER.unpack_from(message)
+                    self.samples["frame_latencies"].append(time.perf_counter() - sent_at)
+                    self.counters["frames_received"] += 1
+                    self.counters["frame_bytes_received"] += len(message)
+                else:
+                    self.counters["unchanged_received"] += 1
+        except websockets.ConnectionClosed:
+            pass
+
+    async def send_chat(self, session_id: str, stop_at: float):
+        if not self.config["chat_interval"]:
+            return
+        loop = asyncio.get_running_loop()
+        client = HttpClient(self.host, self.port)
+        number = 0
+        try:
+            while loop.time() < stop_at:
+                # The user text carries its send time; the wizard echoes it in the reply
+                text = f"lt {number} {time.perf_counter()!r}"
+                if await self.timed_request(client, "POST /message", "POST", "/message",
+                                            {"session_id": session_id, "role": "user", "text": text}) is not None:
+                    self.counters["chat_sent"] += 1
+                number += 1
+                await asyncio.sleep(self.config["chat_interval"])
+        finally:
+            await client.close()
+
+    async def send_logs(self, session_id: str, stop_at: float):
+        if not self.config["log_interval"]:
+            return
+        loop = asyncio.get_running_loop()
+        client = HttpClient(self.host, self.port)
+        try:
+            while loop.time() < stop_at:
+                event = {"session_id": session_id, "event_type": "loadtest", "event_data": {"at": time.time()}}
+                if await self.timed_request(client, "POST /log", "POST", "/log", event) is not None:
+                    self.counters["logs_sent"] += 1
+                await asyncio.sleep(self.config["log_interval"])
+        finally:
+            await client.close()
+
+    async def follow_chat(self, session_id: str, side: str):
+        """The wizard answers every user message; the phone measures the round trip."""
+        reply_client = HttpClient(self.host, self.port)
+        try:
+            async for message in self.chat_messages(session_id):
+                parts = message["text"].split(" ", 2)
+                if len(parts) != 3:
+                    continue
+                kind, number, sent_at = parts
+                if side == "wizard" and message["role"] == "user" and kind == "lt":
+                    self.samples["chat_delivery"].append(time.perf_counter() - float(sent_at))
+                    self.counters["chat_delivered"] += 1
+                    await self.timed_request(reply_client, "POST /message", "POST", "/message",
+                                             {"session_id": session_id, "role": "wizard", "text": f"re {number} {sent_at}"})
+                elif side == "phone" and message["role"] == "wizard" and kind == "re":
+                    self.samples["chat_round_trips"].append(time.perf_counter() - float(sent_at))
+                    self.counters["chat_round_trips"] += 1
+        except (OSError, ValueError, websockets.ConnectionClosed):
+            self.counters["errors"] += 1
+        finally:
+            await reply_client.close()
+
+    async def chat_messages(self, session_id: str):
+        if self.config["chat_mode"] == "stream":
+            async with websockets.connect(f"{self.ws_url}/ws/messages/{session_id}") as stream:
+                async for frame in stream:
+                    yield json.loads(frame)["message"]
+        else:
+            client = HttpClient(self.host, self.port)
+            since = 0
+            try:
+                while True:
+                    status, content = await client.request("GET", f"/sessions/{session_id}?since={since}&wait={POLL_WAIT}")
+                    if status == 404:
+                        # The phone hasn't sent anything yet
+                        await asyncio.sleep(0.1)
+                        continue
+                    body = json.loads(content)
+                    since = body["last_seq"]
+                    for message in body["messages"]:
+                        yield message
+            finally:
+                await client.close()
+
+
+def run_pairs(config: dict, pair_ids: List[int]) -> dict:
+    return asyncio.run(PairRunner(config, pair_ids).run())
+
+
+def percentiles(values: List[float], scale: float = 1000.0) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    def rank(p: float) -> float:
+        return round(ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)] * scale, 3)
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """Resident memory in bytes of a process and all its descendants (Linux only)."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError):
+            if current == pid:
+                return None
+    return total
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(config: dict, workdir: Path) -> subprocess.Popen:
+    port = free_port()
+    config["url"] = f"http://127.0.0.1:{port}"
+    env = {**os.environ, "PYTHONPATH": str(BACKEND_DIR)}
+    if config["workers"] > 1:
+        env["WOZ_BROKER"] = f"127.0.0.1:{free_port()}"
+    # The server's own log output goes to a file, so it doesn't compete with the clients for the terminal
+    log_file = open(workdir / "server.log", "w")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(config["workers"]), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=log_file, stderr=subprocess.STDOUT
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with {server.returncode}, see {workdir / 'server.log'}")
+        try:
+            urllib.request.urlopen(config["url"] + "/", timeout=1).read()
+            # Every worker has to be up and connected to the broker hub
+            time.sleep(1.0 if config["workers"] > 1 else 0)
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("Server did not start within 30 seconds")
+
+
+async def sample_memory(pid: int, timeline: List[List[float]], started: float):
+    while True:
+        rss = process_tree_rss(pid)
+        if rss is not None:
+            timeline.append([round(time.monotonic() - started, 1), round(rss / 2 ** 20, 2)])
+        await asyncio.sleep(SAMPLE_INTERVAL)
+
+
+async def run_clients(config: dict, server_pid: Optional[int]) -> Tuple[List[dict], List[List[float]]]:
+    loop = asyncio.get_running_loop()
+    processes = max(1, min(config["client_processes"], config["pairs"]))
+    slices = [list(range(config["pairs"]))[index::processes] for index in range(processes)]
+    timeline: List[List[float]] = []
+    started = time.monotonic()
+    sampler = asyncio.create_task(sample_memory(server_pid, timeline, started)) if server_pid else None
+    try:
+        if processes == 1:
+            outputs = [await PairRunner(config, slices[0]).run()]
+        else:
+            with ProcessPoolExecutor(processes) as pool:
+                outputs = await asyncio.gather(*[loop.run_in_executor(pool, run_pairs, config, pair_ids) for pair_ids in slices])
+    finally:
+        if sampler:
+            sampler.cancel()
+    if server_pid:
+        rss = process_tree_rss(server_pid)
+        if rss is not None:
+            timeline.append([round(time.monotonic() - started, 1), round(rss / 2 ** 20, 2)])
+    return outputs, timeline
+
+
+def summarize(config: dict, outputs: List[dict], timeline: List[List[float]]) -> dict:
+    counters: Dict[str, int] = {}
+    samples = {"frame_latencies": [], "chat_delivery": [], "chat_round_trips": []}
+    http: Dict[str, dict] = {}
+    for output in outputs:
+        for name, value in output["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+        for name in samples:
+            samples[name].extend(output["samples"][name])
+        for route, route_samples in output["samples"]["http"].items():
+            merged = http.setdefault(route, {"latencies": [], "errors": 0})
+            merged["latencies"].extend(route_samples["latencies"])
+            merged["errors"] += route_samples["errors"]
+
+    duration = config["duration"]
+    memory = None
+    if timeline:
+        memory = {
+            "start_rss_mb": timeline[0][1],
+            "end_rss_mb": timeline[-1][1],
+            "peak_rss_mb": max(rss for _, rss in timeline),
+            "growth_mb": round(timeline[-1][1] - timeline[0][1], 2),
+            "samples": timeline,
+        }
+    return {
+        "config": {name: value for name, value in config.items() if name != "prefix"},
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "frames": {
+            "sent": counters["frames_sent"],
+            "received": counters["frames_received"],
+            "unchanged": counters["unchanged_received"],
+            "delivery_ratio": round(counters["frames_received"] / counters["frames_sent"], 4) if counters["frames_sent"] else None,
+            "sent_per_second": round(counters["frames_sent"] / duration, 2),
+            "received_per_second": round(counters["frames_received"] / duration, 2),
+            "mbit_sent_per_second": round(counters["frame_bytes_sent"] * 8 / duration / 1e6, 2),
+            "mbit_received_per_second": round(counters["frame_bytes_received"] * 8 / duration / 1e6, 2),
+            "latency_ms": percentiles(samples["frame_latencies"]),
+        },
+        "chat": {
+            "sent": counters["chat_sent"],
+            "delivered": counters["chat_delivered"],
+            "round_trips": counters["chat_round_trips"],
+            "delivery_ms": percentiles(samples["chat_delivery"]),
+            "round_trip_ms": percentiles(samples["chat_round_trips"]),
+        },
+        "http": {
+            route: {
+                "count": len(route_samples["latencies"]),
+                "errors": route_samples["errors"],
+                "per_second": round(len(route_samples["latencies"]) / duration, 2),
+                "latency_ms": percentiles(route_samples["latencies"]),
+            }
+            for route, route_samples in sorted(http.items())
+        },
+        "logs_sent": counters["logs_sent"],
+        "errors": counters["errors"],
+        "memory": memory,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def metric(results: dict, path: str):
+    value = results
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def compare(results: dict, baseline: dict) -> List[dict]:
+    rows = []
+    for path, higher_is_better in BASELINE_METRICS:
+        current, previous = metric(results, path), metric(baseline, path)
+        if current is None or previous is None:
+            continue
+        change = (current - previous) / previous if previous else None
+        regressed = change is not None and (change < -REGRESSION_THRESHOLD if higher_is_better else change > REGRESSION_THRESHOLD)
+        rows.append({"metric": path, "baseline": previous, "current": current,
+                     "change": round(change, 4) if change is not None else None, "regressed": regressed})
+    return rows
+
+
+def print_report(results: dict):
+    frames, chat = results["frames"], results["chat"]
+    print(f"frames: {frames['sent']} sent, {frames['received']} received ({frames['received_per_second']}/s, "
+          f"{frames['mbit_received_per_second']} Mbit/s), delivery {frames['delivery_ratio']}")
+    if frames["latency_ms"]:
+        print("  relay latency ms: p50 {p50}  p95 {p95}  p99 {p99}  max {max}".format(**frames["latency_ms"]))
+    print(f"chat: {chat['sent']} sent, {chat['delivered']} delivered, {chat['round_trips']} round trips")
+    if chat["round_trip_ms"]:
+        print("  round trip ms: p50 {p50}  p95 {p95}  p99 {p99}".format(**chat["round_trip_ms"]))
+    for route, stats in results["http"].items():
+        if stats["latency_ms"]:
+            print(f"{route}: {stats['count']} ({stats['errors']} errors), p50 {stats['latency_ms']['p50']} ms, p95 {stats['latency_ms']['p95']} ms")
+    if results["memory"]:
+        memory = results["memory"]
+        print(f"server rss: {memory['start_rss_mb']} → {memory['end_rss_mb']} MB (peak {memory['peak_rss_mb']} MB)")
+    print(f"errors: {results['errors']}")
+    for row in results.get("comparison", []):
+        flag = "  REGRESSED" if row["regressed"] else ""
+        change = f"{row['change']:+.1%}" if row["change"] is not None else "n/a"
+        print(f"  {row['metric']}: {row['baseline']} → {row['current']} ({change}){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test for the WOZ backend")
+    parser.add_argument("--pairs", type=int, default=10, help="simulated phone/wizard pairs")
+    parser.add_argument("--frame-size", type=int, default=50_000, help="bytes per screen frame")
+    parser.add_argument("--fps", type=float, default=5.0, help="frames per second per phone")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait for in-flight messages afterwards")
+    parser.add_argument("--chat-interval", type=float, default=2.0, help="seconds between user messages per phone, 0 for none")
+    parser.add_argument("--log-interval", type=float, default=1.0, help="seconds between /log events per phone, 0 for none")
+    parser.add_argument("--chat-mode", choices=["stream", "poll"], default="stream",
+                        help="follow chat through /ws/messages or by long-polling /sessions/{id}")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the local server")
+    parser.add_argument("--client-processes", type=int, default=1, help="processes the simulated clients are spread over")
+    parser.add_argument("--url", help="test a running server instead of starting one, e.g. http://127.0.0.1:8000")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    parser.add_argument("--baseline", type=Path, help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    config = {
+        "pairs": args.pairs,
+        "frame_size": max(args.frame_size, FRAME_HEADER.size),
+        "fps": args.fps,
+        "duration": args.duration,
+        "drain": args.drain,
+        "chat_interval": args.chat_interval,
+        "log_interval": args.log_interval,
+        "chat_mode": args.chat_mode,
+        "workers": args.workers,
+        "client_processes": args.client_processes,
+        "url": args.url,
+        # Distinct session ids per run, so runs against the same server don't see each other's history
+        "prefix": f"lt{int(time.time())}",
+    }
+
+    server = None
+    workdir = Path(tempfile.mkdtemp(prefix="woz-loadtest-"))
+    try:
+        if not args.url:
+            server = start_server(config, workdir)
+        outputs, timeline = asyncio.run(run_clients(config, server.pid if server else None))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = summarize(config, outputs, timeline)
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        results["comparison"] = compare(results, baseline)
+        if {**baseline["config"], "url": None} != {**results["config"], "url": None}:
+            print("warning: the baseline was run with a different configuration")
+    print_report(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False))
+    if any(row["regressed"] for row in results.get("comparison", [])):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,50 @@
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
-from typing import Dict, Optional
+from typing import Counter, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import collections
+import csv
+import hashlib
+import io
+import json
 import logging
+import time
+import weakref
 from datetime import datetime
-from frequent_response_routes import router as frequent_response_router
+from pathlib import Path
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from analytics import SessionAnalytics, usage_by_task
+from event_log import EventLogWriter
+from frame_transcoder import ViewerQuality, requested_quality, pool as transcode_pool
+from frequent_response_routes import router as frequent_response_router, response_search
+from metrics import Exposition, Histogram, LoopLagMonitor, RequestMetrics, RouteStats, TrafficMeter
+from pubsub import MESSAGES_CHANNEL, broker, frames_channel
+from recording_routes import router as recording_router, get_recorder
+from response_cache import MIN_COMPRESS_SIZE, StaticFile, conditional_json, make_etag
+from session_store import SessionStore
+
+# Log calls on the event loop only enqueue the record; a listener thread writes the file
+log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_handlers = [
+    logging.FileHandler('wizard_of_oz.log'),
+    logging.StreamHandler()
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+log_queue: SimpleQueue = SimpleQueue()
+queue_handler = QueueHandler(log_queue)
+queue_handler.setFormatter(logging.Formatter('%(message)s'))
+log_listener = QueueListener(log_queue, *log_handlers)
 
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('wizard_of_oz.log'),
-        logging.StreamHandler()
-    ]
+    handlers=[queue_handler]
 )
+log_listener.start()
 
 logger = logging.getLogger(__name__)
 
@@ -27,9 +57,42 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Compresses large bodies that weren't pre-compressed by response_cache
+app.add_middleware(GZipMiddleware, minimum_size=MIN_COMPRESS_SIZE)
+# Outermost, so request durations include every other middleware
+route_stats = RouteStats()
+app.add_middleware(RequestMetrics, stats=route_stats)
 app.include_router(frequent_response_router)
+app.include_router(recording_router)
+
+sessions = SessionStore()
+events = EventLogWriter()
+# Kept in memory and pre-gzipped; reloaded when the file changes
+wizard_page = StaticFile(Path("wizard_interface.html"), "text/html")
+
+# Roles whose messages are replies written (or picked) by the wizard
+WIZARD_ROLES = ["wizard", "assistant"]
+# Rebuilt from sessions.db in the background after startup, then kept up to date by on_message_stored
+analytics = SessionAnalytics(WIZARD_ROLES)
+# Messages stored while the rebuild runs, counted once it is done; None afterwards
+messages_during_rebuild: Optional[list] = []
+statistics_rebuild: Optional[asyncio.Task] = None
+# Only sessions somebody is waiting on have a condition; it goes away with the last waiter
+session_conditions: "weakref.WeakValueDictionary[str, asyncio.Condition]" = weakref.WeakValueDictionary()
+# Notifications scheduled from broker callbacks, referenced until they finish
+pending_notifications: "set[asyncio.Task]" = set()
+# Open /ws/messages streams
+message_streams: "set[WebSocket]" = set()
+loop_lag = LoopLagMonitor()
 
-sessions: Dict[str, list] = {}
+# Upper bound for the long-poll `wait` parameter of GET /sessions/{session_id}
+MAX_LONG_POLL_WAIT = 30.0
+# Upper bound for the `limit` parameter of GET /sessions
+MAX_SESSIONS_PAGE = 1000
+# Frames waiting for a slow viewer; older ones are dropped so the newest screen wins
+FRAME_QUEUE_SIZE = 2
+# Sent to the wizard in place of a frame identical to the previous one
+UNCHANGED_FRAME = json.dumps({"type": "unchanged"})
 
 class MessageRequest(BaseModel):
     session_id: str
@@ -51,35 +114,215 @@ class LogResponse(BaseModel):
     status: str
     logged_at: str
 
+class LogBatchResponse(BaseModel):
+    status: str
+    count: int
+    logged_at: str
+
 
 class ConnectionManager:
     def __init__(self):
         self.active_connections: Dict[str, WebSocket] = {}
+        self.frame_queues: Dict[str, asyncio.Queue] = {}
+        self.sender_tasks: Dict[str, asyncio.Task] = {}
+        self.frame_stats: Dict[str, Dict[str, int]] = {}
+        self.last_fingerprints: Dict[str, bytes] = {}
+        # Frames received from each phone and sent to each wizard, for /metrics
+        self.traffic: Dict[str, TrafficMeter] = {}
+        self.send_durations = Histogram()
+        # Wizards that asked for downscaled frames, and the CPU time each re-encoded frame took
+        self.viewer_quality: Dict[str, ViewerQuality] = {}
+        self.transcode_durations = Histogram()
 
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def connect(self, websocket: WebSocket, client_id: str, quality: Optional[ViewerQuality] = None):
         await websocket.accept()
+        self.stop_sender(client_id)
         self.active_connections[client_id] = websocket
+        self.traffic[client_id] = TrafficMeter()
+        if quality:
+            # Relay counters outlive connections; only drops from now on count against this one
+            quality.checked_dropped = self.get_frame_stats(client_id)["dropped"]
+            self.viewer_quality[client_id] = quality
+        else:
+            self.viewer_quality.pop(client_id, None)
 
     def disconnect(self, client_id: str):
         if client_id in self.active_connections:
             del self.active_connections[client_id]
+        self.traffic.pop(client_id, None)
+        self.viewer_quality.pop(client_id, None)
+        self.stop_sender(client_id)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         await websocket.send_text(message)
 
-    async def broadcast_bytes(self, data: bytes, target_id: str):
-        # Relay data from Phone (source) to Wizard (target)
-        if target_id in self.active_connections:
-            await self.active_connections[target_id].send_bytes(data)
+    def get_frame_stats(self, target_id: str) -> Dict[str, int]:
+        if target_id not in self.frame_stats:
+            self.frame_stats[target_id] = {"received": 0, "forwarded": 0, "dropped": 0, "unchanged": 0}
+        return self.frame_stats[target_id]
+
+    def stop_sender(self, target_id: str):
+        task = self.sender_tasks.pop(target_id, None)
+        if task:
+            task.cancel()
+        self.frame_queues.pop(target_id, None)
+        # A (re)connecting viewer must get a full frame first
+        self.last_fingerprints.pop(target_id, None)
+
+    def broadcast_bytes(self, data: bytes, target_id: str):
+        # Relay data from Phone (source) to Wizard (target).
+        # Only enqueues; the target's sender task does the actual send,
+        # so a slow viewer never stalls the phone's receive loop
+        # (or the broker connection the frame arrived on).
+        stats = self.get_frame_stats(target_id)
+        stats["received"] += 1
+        if target_id not in self.active_connections:
+            stats["dropped"] += 1
+            return
+
+        # The screen is mostly static, so identical frames are replaced by a heartbeat
+        fingerprint = hashlib.blake2b(data, digest_size=16).digest()
+        if self.last_fingerprints.get(target_id) == fingerprint:
+            stats["unchanged"] += 1
+            # A heartbeat must never push a pending frame out of the queue, or the
+            # wizard would miss the newest screen; anything queued already shows liveness
+            queue = self.frame_queues.get(target_id)
+            if queue is None or queue.empty():
+                self.enqueue_frame(target_id, UNCHANGED_FRAME)
+            return
+        self.last_fingerprints[target_id] = fingerprint
+        self.enqueue_frame(target_id, data)
+
+    def enqueue_frame(self, target_id: str, item):
+        if target_id not in self.sender_tasks:
+            self.frame_queues[target_id] = asyncio.Queue(maxsize=FRAME_QUEUE_SIZE)
+            self.sender_tasks[target_id] = asyncio.create_task(self.send_frames(target_id))
+
+        queue = self.frame_queues[target_id]
+        if queue.full():
+            if isinstance(queue.get_nowait(), bytes):
+                self.get_frame_stats(target_id)["dropped"] += 1
+        queue.put_nowait(item)
+
+    async def send_frames(self, target_id: str):
+        websocket = self.active_connections[target_id]
+        queue = self.frame_queues[target_id]
+        stats = self.get_frame_stats(target_id)
+        meter = self.traffic.get(target_id) or TrafficMeter()
+        quality = self.viewer_quality.get(target_id)
+        while True:
+            item = await queue.get()
+            try:
+                if isinstance(item, bytes):
+                    if quality:
+                        # Only frames that survived the queue are re-encoded, off the event loop
+                        item, cpu_seconds = await quality.transcode(item)
+                        self.transcode_durations.observe(cpu_seconds)
+                    started = time.perf_counter()
+                    await websocket.send_bytes(item)
+                    # How long the wizard's connection took to accept the frame
+                    elapsed = time.perf_counter() - started
+                    stats["forwarded"] += 1
+                    meter.add(len(item))
+                    meter.send_seconds += elapsed
+                    self.send_durations.observe(elapsed)
+                    if quality:
+                        quality.adapt(meter, stats["dropped"], target_id)
+                else:
+                    await websocket.send_text(item)
+            except Exception as e:
+                # The viewer's own handler notices the disconnect and cleans up
+                logger.warning(f"Frame relay to {target_id} stopped: {str(e)}")
+                return
 
 manager = ConnectionManager()
 
+def get_session_condition(session_id: str) -> asyncio.Condition:
+    # Long-poll readers and message streams of a session wait on this until a new message arrives
+    condition = session_conditions.get(session_id)
+    if condition is None:
+        condition = asyncio.Condition()
+        session_conditions[session_id] = condition
+    return condition
+
+def has_messages_after(session_id: str, seq: int) -> bool:
+    return sessions.message_count(session_id) > seq
+
+async def wait_for_messages_after(session_id: str, seq: int):
+    condition = get_session_condition(session_id)
+    async with condition:
+        await condition.wait_for(lambda: has_messages_after(session_id, seq))
+
+async def notify_session(condition: asyncio.Condition):
+    async with condition:
+        condition.notify_all()
+
+def on_message_stored(payload: bytes):
+    # Runs in every worker for every message, whichever worker stored it
+    published = json.loads(payload)
+    session_id, message = published["session_id"], published["message"]
+    sessions.sync(session_id, message["seq"])
+    if messages_during_rebuild is not None:
+        messages_during_rebuild.append((session_id, message))
+    else:
+        count_message(session_id, message)
+    recorder = get_recorder(session_id)
+    if recorder:
+        recorder.record_message(message)
+
+    # Wakes every long-poll request and message stream subscribed to the session
+    condition = session_conditions.get(session_id)
+    if condition is not None:
+        task = asyncio.get_running_loop().create_task(notify_session(condition))
+        pending_notifications.add(task)
+        task.add_done_callback(pending_notifications.discard)
+
+broker.subscribe(MESSAGES_CHANNEL, on_message_stored)
+
+def count_message(session_id: str, message: dict):
+    # Two workers appending to one session can publish seq N+1 before seq N, and
+    # analytics counts a session's messages in seq order: the ones skipped over are
+    # read from the transcript, which sessions.sync has loaded up to this seq
+    last_seq = analytics.last_seq.get(session_id, 0)
+    missed = (sessions.get(session_id) or [])[last_seq:message["seq"] - 1] if message["seq"] > last_seq + 1 else []
+    for counted in [*missed, message]:
+        # analytics skips messages it already counted, e.g. both in the rebuild and delivered live
+        if analytics.record(session_id, counted) and counted["role"] in WIZARD_ROLES:
+            # Ranks search results by how often each frequent response was actually sent
+            response_search.record_sent(counted["text"])
+
+def read_statistics() -> Tuple[SessionAnalytics, Counter[str]]:
+    """One pass over a snapshot of every stored message; runs in a worker thread."""
+    rebuilt = SessionAnalytics(WIZARD_ROLES)
+    sent: Counter[str] = collections.Counter()
+    for rows in sessions.export_rows():
+        rebuilt.record_many(rows)
+        sent.update(text for _, _, role, text, _ in rows if role in WIZARD_ROLES)
+    return rebuilt, sent
+
+async def rebuild_statistics():
+    global analytics, messages_during_rebuild
+    started = time.perf_counter()
+    try:
+        rebuilt, sent = await asyncio.to_thread(read_statistics)
+    except Exception as e:
+        logger.error(f"Error rebuilding analytics: {str(e)}")
+        rebuilt, sent = SessionAnalytics(WIZARD_ROLES), collections.Counter()
+    # Swapped in on the event loop, so requests never see a half-built state
+    analytics = rebuilt
+    for text, count in sent.items():
+        response_search.record_sent(text, count)
+    pending, messages_during_rebuild = messages_during_rebuild, None
+    for session_id, message in pending:
+        count_message(session_id, message)
+    logger.info(f"Analytics rebuilt from {analytics.messages_per_session.total} messages in {time.perf_counter() - started:.2f}s")
+
 @app.get("/")
 async def root():
     return {
         "service": "Senior Helper WOZ API",
         "version": "1.0.0",
-        "endpoints": ["/message", "/log", "/sessions"]
+        "endpoints": ["/message", "/log", "/log/batch", "/sessions", "/export", "/analytics", "/metrics"]
     }
 
 @app.post("/message", response_model=MessageResponse)
@@ -91,17 +334,16 @@ async def handle_message(request: MessageRequest):
     """
     try:
         if request.session_id not in sessions:
-            sessions[request.session_id] = []
-            logger.info(f"New session created: {request.session_id}")
+            sessions.create(request.session_id, datetime.now().isoformat())
+            logger.info("New session created: %s", request.session_id)
         
-        message_entry = {
-            "role": request.role,
-            "text": request.text,
-            "timestamp": datetime.now().isoformat()
-        }
-        sessions[request.session_id].append(message_entry)
+        message_entry = sessions.append(request.session_id, request.role, request.text, datetime.now().isoformat())
+        broker.publish(MESSAGES_CHANNEL, json.dumps({
+            "session_id": request.session_id,
+            "message": message_entry
+        }, ensure_ascii=False).encode("utf-8"))
         
-        logger.info(f"Session {request.session_id} - {request.role}: {request.text}")
+        logger.info("Session %s - %s: %s", request.session_id, request.role, request.text)
         
         # ONLY return automated response if role is "user" AND you want auto-replies
         # For pure Wizard-of-Oz, we DON'T auto-reply
@@ -120,71 +362,367 @@ async def handle_message(request: MessageRequest):
         logger.error(f"Error handling message: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def make_log_entry(request: LogRequest, received_at: str) -> dict:
+    return {
+        "session_id": request.session_id,
+        "event_type": request.event_type,
+        "event_data": request.event_data or {},
+        "timestamp": request.timestamp or received_at
+    }
+
 @app.post("/log", response_model=LogResponse)
 async def log_event(request: LogRequest):
     try:
-        timestamp = request.timestamp or datetime.now().isoformat()
-        
-        log_entry = {
-            "session_id": request.session_id,
-            "event_type": request.event_type,
-            "event_data": request.event_data or {},
-            "timestamp": timestamp
-        }
-        
-        logger.info(f"Event logged: {log_entry}")
+        log_entry = make_log_entry(request, datetime.now().isoformat())
+        # Serialized and written in batches by the event log thread
+        events.write(log_entry)
         
         return LogResponse(
             status="logged",
-            logged_at=timestamp
+            logged_at=log_entry["timestamp"]
         )
     
     except Exception as e:
         logger.error(f"Error logging event: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/log/batch", response_model=LogBatchResponse)
+async def log_events(requests: List[LogRequest]):
+    """
+    Logs several events in one request, so clients can buffer
+    UI telemetry instead of sending one request per event.
+    """
+    try:
+        received_at = datetime.now().isoformat()
+        events.write_many([make_log_entry(request, received_at) for request in requests])
+        
+        return LogBatchResponse(
+            status="logged",
+            count=len(requests),
+            logged_at=received_at
+        )
+    
+    except Exception as e:
+        logger.error(f"Error logging events: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.get("/sessions/{session_id}")
-async def get_session(session_id: str):
-    if session_id not in sessions:
+async def get_session(request: Request, session_id: str, since: int = 0, wait: float = 0):
+    """
+    Returns the messages of a session whose seq is greater than `since`.
+    With `wait` > 0 the request is held open for up to `wait` seconds
+    until a newer message arrives, instead of returning an empty list.
+    """
+    since = max(since, 0)
+    wait = min(max(wait, 0), MAX_LONG_POLL_WAIT)
+
+    if wait > 0 and not has_messages_after(session_id, since):
+        try:
+            await asyncio.wait_for(wait_for_messages_after(session_id, since), timeout=wait)
+        except asyncio.TimeoutError:
+            pass
+
+    messages = sessions.get(session_id)
+    if messages is None:
         raise HTTPException(status_code=404, detail="Session not found")
-    
+
+    # seq is 1-based and equals the list position, so the cursor is a slice.
+    # Messages never change once stored, so (since, last_seq) fully identifies the body.
+    etag = make_etag("session", session_id, since, len(messages))
+    return conditional_json(request, etag, lambda: {
+        "session_id": session_id,
+        "messages": messages[since:],
+        "last_seq": len(messages)
+    })
+
+@app.get("/sessions/{session_id}/relay")
+async def get_relay_stats(session_id: str):
+    """
+    Screen relay counters of a session: frames received from the phone,
+    forwarded to the wizard, dropped (no viewer, or replaced by a newer frame),
+    and unchanged (identical to the previous frame, sent as a heartbeat).
+    Counted by the worker the wizard is connected to.
+    """
+    target_id = f"wizard_{session_id}"
+    queue = manager.frame_queues.get(target_id)
+    quality = manager.viewer_quality.get(target_id)
     return {
         "session_id": session_id,
-        "messages": sessions[session_id]
+        "wizard_connected": target_id in manager.active_connections,
+        "queued": queue.qsize() if queue else 0,
+        **manager.frame_stats.get(target_id, {"received": 0, "forwarded": 0, "dropped": 0, "unchanged": 0}),
+        "transcoding": quality.stats() if quality else None
     }
 
 @app.get("/sessions")
-async def list_sessions():
+async def list_sessions(after: str = "", limit: int = 100):
+    """
+    Pages through session ids in key order. Pass the returned `next`
+    as `after` to get the following page; it is null on the last page.
+    """
+    limit = min(max(limit, 1), MAX_SESSIONS_PAGE)
+    page = sessions.list_page(after, limit)
+    return {
+        "sessions": page,
+        "count": len(sessions),
+        "next": page[-1] if len(page) == limit else None
+    }
+
+EXPORT_COLUMNS = ["session_id", "seq", "role", "text", "timestamp"]
+
+def export_ndjson(batches: Iterator[List[tuple]]) -> Iterator[str]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+def export_csv(batches: Iterator[List[tuple]]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # The BOM lets Excel detect UTF-8, so Korean text isn't garbled
+    buffer.write("\ufeff")
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def parse_time_bound(name: str, value: str) -> str:
+    """Normalizes an ISO date or datetime so it compares with stored timestamps as text."""
+    if not value:
+        return ""
+    try:
+        return datetime.fromisoformat(value).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date or datetime")
+
+@app.get("/export")
+async def export_sessions(format: str = "ndjson", start: str = "", end: str = ""):
+    """
+    Streams every stored message, one row per message in session/seq order,
+    as NDJSON or CSV. `start` and `end` (ISO dates or datetimes, end
+    excluded) limit the export to messages sent in that time range.
+    Rows are read and formatted a batch at a time in a worker thread, so
+    memory stays flat and live sessions keep being served during an export.
+    """
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    batches = sessions.export_rows(parse_time_bound("start", start), parse_time_bound("end", end))
+    # Starlette iterates sync generators in its thread pool
+    if format == "csv":
+        body, media_type = export_csv(batches), "text/csv"
+    else:
+        body, media_type = export_ndjson(batches), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="sessions.{format}"'}
+    )
+
+@app.get("/analytics")
+async def get_analytics():
+    """
+    Study statistics over every stored session, maintained as messages
+    arrive: wizard response time percentiles (seconds from a user message
+    to the next wizard/assistant message), messages per session, and how
+    often the frequent responses of each task were sent. Answers 503
+    for the first moments after startup, while they are rebuilt.
+    """
+    if messages_during_rebuild is not None:
+        raise HTTPException(status_code=503, detail="Analytics are still being rebuilt", headers={"Retry-After": "1"})
     return {
-        "sessions": list(sessions.keys()),
-        "count": len(sessions)
+        **analytics.summary(),
+        "frequent_responses_by_task": usage_by_task(response_search.items.values(), response_search.usage),
     }
 
 @app.get("/wizard", response_class=HTMLResponse)
-async def get_wizard_interface():
-    with open("wizard_interface.html", "r") as f:
-        return f.read()
+async def get_wizard_interface(request: Request):
+    return wizard_page.response(request)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus text format. Relay series are per connection (role phone or
+    wizard): low phone frame rates point at a slow upload, high wizard send
+    times and queued/dropped frames at a slow download, and event loop lag
+    at something blocking this process.
+    """
+    page = Exposition()
+    page.histogram(
+        "woz_http_request_duration_seconds", "Time to handle HTTP requests, by route template.",
+        (({"method": method, "route": route}, histogram) for (method, route), histogram in sorted(route_stats.durations.items()))
+    )
+    page.metric(
+        "woz_http_requests_total", "counter", "HTTP responses, by route template and status.",
+        (({"method": method, "route": route, "status": str(status)}, count)
+         for (method, route, status), count in sorted(route_stats.responses.items()))
+    )
+
+    roles = {"phone": 0, "wizard": 0}
+    for client_id in manager.active_connections:
+        role = client_id.partition("_")[0]
+        roles[role] = roles.get(role, 0) + 1
+    roles["messages"] = len(message_streams)
+    page.metric("woz_websocket_connections", "gauge", "Open WebSocket connections, by role.",
+                (({"role": role}, count) for role, count in roles.items()))
+
+    now = time.monotonic()
+    connections = []
+    for client_id, meter in sorted(manager.traffic.items()):
+        role, _, session_id = client_id.partition("_")
+        connections.append(({"session": session_id, "role": role}, meter, meter.rates()))
+    page.metric("woz_relay_connected_seconds", "gauge", "Seconds since the phone or wizard WebSocket connected.",
+                ((labels, now - meter.connected_at) for labels, meter, _ in connections))
+    page.metric("woz_relay_frames_total", "counter", "Frames received from the phone, or sent to the wizard.",
+                ((labels, meter.frames) for labels, meter, _ in connections))
+    page.metric("woz_relay_bytes_total", "counter", "Frame bytes received from the phone, or sent to the wizard.",
+                ((labels, meter.bytes) for labels, meter, _ in connections))
+    page.metric("woz_relay_frames_per_second", "gauge", "Frame rate over the last few seconds.",
+                ((labels, rates[0]) for labels, _, rates in connections))
+    page.metric("woz_relay_bytes_per_second", "gauge", "Byte rate over the last few seconds.",
+                ((labels, rates[1]) for labels, _, rates in connections))
+
+    wizards = [(labels, meter, f"wizard_{labels['session']}") for labels, meter, _ in connections if labels["role"] == "wizard"]
+    page.metric("woz_relay_send_seconds_total", "counter", "Time spent sending frames to the wizard.",
+                ((labels, meter.send_seconds) for labels, meter, _ in wizards))
+    page.metric("woz_relay_queued_frames", "gauge", "Frames waiting to be sent to the wizard.",
+                ((labels, manager.frame_queues[target_id].qsize() if target_id in manager.frame_queues else 0)
+                 for labels, _, target_id in wizards))
+    page.metric("woz_relay_dropped_frames_total", "counter", "Frames for the wizard replaced by a newer one before being sent.",
+                ((labels, manager.get_frame_stats(target_id)["dropped"]) for labels, _, target_id in wizards))
+    page.histogram("woz_relay_send_duration_seconds", "Time to send one frame to a wizard.",
+                   [({}, manager.send_durations)])
+    transcoding = [(labels, manager.viewer_quality[target_id]) for labels, _, target_id in wizards if target_id in manager.viewer_quality]
+    page.metric("woz_relay_frame_size_pixels", "gauge", "Longest side frames are downscaled to for the wizard.",
+                ((labels, quality.setting[0]) for labels, quality in transcoding))
+    page.metric("woz_relay_frame_quality", "gauge", "JPEG quality frames are re-encoded at for the wizard.",
+                ((labels, quality.setting[1]) for labels, quality in transcoding))
+    page.metric("woz_relay_transcoded_bytes_in_total", "counter", "Frame bytes before re-encoding for the wizard.",
+                ((labels, quality.bytes_in) for labels, quality in transcoding))
+    page.histogram("woz_relay_transcode_cpu_seconds", "CPU time to downscale and re-encode one frame.",
+                   [({}, manager.transcode_durations)])
+
+    page.metric("woz_event_loop_lag_last_seconds", "gauge", "How late the last event loop probe woke up.",
+                [({}, loop_lag.last)])
+    page.histogram("woz_event_loop_lag_seconds", "How late event loop probes wake up.", [({}, loop_lag.histogram)])
+
+    cached_sessions, cached_messages, cached_bytes = sessions.memory_usage()
+    page.metric("woz_sessions", "gauge", "Sessions stored.", [({}, len(sessions))])
+    page.metric("woz_sessions_cached", "gauge", "Session transcripts held in memory.", [({}, cached_sessions)])
+    page.metric("woz_sessions_cached_messages", "gauge", "Messages held in memory.", [({}, cached_messages)])
+    page.metric("woz_sessions_cached_bytes", "gauge", "Approximate text size of the messages held in memory.", [({}, cached_bytes)])
+    return Response(page.text(), media_type=Exposition.content_type)
 
 @app.websocket("/ws/phone/{session_id}")
 async def websocket_phone(websocket: WebSocket, session_id: str):
     await manager.connect(websocket, f"phone_{session_id}")
+    meter = manager.traffic[f"phone_{session_id}"]
     try:
         while True:
             # Receive image bytes from phone
             data = await websocket.receive_bytes()
-            # Forward immediately to the wizard of this session
-            await manager.broadcast_bytes(data, f"wizard_{session_id}")
+            meter.add(len(data))
+            # Forward immediately to the wizard (and recorder) of this session, in whichever worker it is
+            broker.publish(frames_channel(session_id), data, lossy=True)
     except WebSocketDisconnect:
         manager.disconnect(f"phone_{session_id}")
 
 @app.websocket("/ws/wizard/{session_id}")
-async def websocket_wizard(websocket: WebSocket, session_id: str):
-    await manager.connect(websocket, f"wizard_{session_id}")
+async def websocket_wizard(websocket: WebSocket, session_id: str, size: int = 0, quality: int = 0, adaptive: bool = False):
+    """
+    Relays the phone's screen frames. With `size` (longest side in pixels),
+    `quality` (JPEG quality) or `adaptive`, frames are downscaled and
+    re-encoded for this viewer; `adaptive` lowers the setting while the
+    viewer's connection can't keep up.
+    """
+    target_id = f"wizard_{session_id}"
+    await manager.connect(websocket, target_id, requested_quality(size, quality, adaptive))
+    def relay(data: bytes):
+        manager.broadcast_bytes(data, target_id)
+    broker.subscribe(frames_channel(session_id), relay)
     try:
         while True:
             await websocket.receive_text() # Keep connection alive
     except WebSocketDisconnect:
-        manager.disconnect(f"wizard_{session_id}")
+        manager.disconnect(target_id)
+    finally:
+        broker.unsubscribe(frames_channel(session_id), relay)
+
+async def push_messages(websocket: WebSocket, session_id: str, since: int):
+    cursor = since
+    while True:
+        await wait_for_messages_after(session_id, cursor)
+        new_messages = sessions.get(session_id)[cursor:]
+        try:
+            for message in new_messages:
+                await websocket.send_text(json.dumps({
+                    "type": "message",
+                    "session_id": session_id,
+                    "message": message
+                }, ensure_ascii=False))
+        except Exception as e:
+            # The stream's own handler notices the disconnect and cleans up
+            logger.warning(f"Message stream for {session_id} stopped: {str(e)}")
+            return
+        cursor += len(new_messages)
+
+@app.websocket("/ws/messages/{session_id}")
+async def websocket_messages(websocket: WebSocket, session_id: str, since: int = 0):
+    """
+    Pushes chat messages of a session as JSON text frames, replacing polling.
+    A reconnecting client passes the last seq it received as `since` and
+    gets everything after it before the live stream continues.
+    """
+    await websocket.accept()
+    message_streams.add(websocket)
+    sender = asyncio.create_task(push_messages(websocket, session_id, max(since, 0)))
+    try:
+        while True:
+            await websocket.receive_text() # Keep connection alive
+    except WebSocketDisconnect:
+        pass
+    finally:
+        message_streams.discard(websocket)
+        sender.cancel()
+
+@app.on_event("startup")
+async def start_broker():
+    await broker.start()
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag.start()
+
+@app.on_event("startup")
+async def start_statistics_rebuild():
+    global statistics_rebuild
+    # Not awaited: the server accepts connections while it runs
+    statistics_rebuild = asyncio.get_running_loop().create_task(rebuild_statistics())
+
+@app.on_event("shutdown")
+def stop_loop_lag_monitor():
+    loop_lag.stop()
+
+@app.on_event("shutdown")
+async def close_broker():
+    await broker.close()
+
+@app.on_event("shutdown")
+def stop_transcoding():
+    transcode_pool.shutdown(wait=False, cancel_futures=True)
+
+@app.on_event("shutdown")
+def close_session_store():
+    sessions.close()
+
+@app.on_event("shutdown")
+def flush_logs():
+    events.close()
+    log_listener.stop()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,187 @@
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Sequence, Tuple
+import asyncio
+import bisect
+import time
+
+
+# Upper bounds (seconds) of the request and frame send duration buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Upper bounds (seconds) of the event loop lag buckets
+LOOP_LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+# Seconds between event loop lag probes
+LOOP_LAG_INTERVAL = 0.25
+# Whole seconds that frames/bytes per second are averaged over
+RATE_WINDOW = 5
+
+Labels = Dict[str, str]
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is a bisect and three additions."""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class TrafficMeter:
+    """Frame and byte totals of one WebSocket connection, plus their rate over the last RATE_WINDOW seconds."""
+
+    def __init__(self):
+        self.connected_at = time.monotonic()
+        self.frames = 0
+        self.bytes = 0
+        # Seconds spent in websocket sends, for connections the server writes frames to
+        self.send_seconds = 0.0
+        # [second, frames, bytes] for the most recent seconds with traffic
+        self.recent: Deque[List[int]] = deque()
+
+    def add(self, size: int):
+        self.frames += 1
+        self.bytes += size
+        second = int(time.monotonic())
+        if self.recent and self.recent[-1][0] == second:
+            self.recent[-1][1] += 1
+            self.recent[-1][2] += size
+        else:
+            self.recent.append([second, 1, size])
+            while self.recent[0][0] < second - RATE_WINDOW:
+                self.recent.popleft()
+
+    def rates(self) -> Tuple[float, float]:
+        """Frames and bytes per second over the last RATE_WINDOW whole seconds."""
+        current = int(time.monotonic())
+        window = [entry for entry in self.recent if current - RATE_WINDOW <= entry[0] < current]
+        return sum(entry[1] for entry in window) / RATE_WINDOW, sum(entry[2] for entry in window) / RATE_WINDOW
+
+
+class LoopLagMonitor:
+    """
+    Sleeps LOOP_LAG_INTERVAL at a time and records how late it wakes up.
+    A large lag means something is blocking the event loop, which delays
+    every relay and request in the process.
+    """
+
+    def __init__(self):
+        self.histogram = Histogram(LOOP_LAG_BUCKETS)
+        self.last = 0.0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(LOOP_LAG_INTERVAL)
+            self.last = max(loop.time() - started - LOOP_LAG_INTERVAL, 0.0)
+            self.histogram.observe(self.last)
+
+
+class RouteStats:
+    """Request durations by (method, route) and response counts by (method, route, status)."""
+
+    def __init__(self):
+        self.durations: Dict[Tuple[str, str], Histogram] = {}
+        self.responses: Dict[Tuple[str, str, int], int] = {}
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        histogram = self.durations.get((method, route))
+        if histogram is None:
+            histogram = self.durations[(method, route)] = Histogram()
+        histogram.observe(seconds)
+        key = (method, route, status)
+        self.responses[key] = self.responses.get(key, 0) + 1
+
+
+class RequestMetrics:
+    """
+    ASGI middleware timing every HTTP request by method and route template
+    (e.g. /sessions/{session_id}), so path parameters don't create new series.
+    """
+
+    def __init__(self, app, stats: RouteStats):
+        self.app = app
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Set by the router on the same scope dict once a route matched
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.stats.observe(scope["method"], route, status, time.perf_counter() - started)
+
+
+class Exposition:
+    """Builds a Prometheus text format (version 0.0.4) page."""
+
+    # Starlette appends "; charset=utf-8" to text/ media types
+    content_type = "text/plain; version=0.0.4"
+
+    def __init__(self):
+        self.lines: List[str] = []
+
+    def metric(self, name: str, kind: str, help: str, samples: Iterable[Tuple[Labels, float]]):
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            self.lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+
+    def histogram(self, name: str, help: str, series: Iterable[Tuple[Labels, Histogram]]):
+        self.lines.append(f"# HELP {name} {help}")
+        self.lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, count in zip((*histogram.buckets, float("inf")), histogram.counts):
+                cumulative += count
+                self.lines.append(f"{name}_bucket{format_labels({**labels, 'le': format_value(bound)})} {cumulative}")
+            self.lines.append(f"{name}_sum{format_labels(labels)} {format_value(histogram.sum)}")
+            self.lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+    def text(self) -> str:
+        return "\n".join(self.lines) + "\n"
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels.items()) + "}"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and not value.is_integer():
+        return repr(value)
+    return str(int(value))
@@ -0,0 +1,222 @@
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import asyncio
+import logging
+import os
+import struct
+import uuid
+
+
+logger = logging.getLogger(__name__)
+
+# host:port of the broker hub shared by all workers; empty keeps everything in this process
+BROKER_ADDRESS = os.environ.get("WOZ_BROKER", "")
+# Seconds between attempts to reach (or become) the hub after losing it
+RECONNECT_DELAY = 0.5
+# Bytes buffered for a slow peer before lossy messages (screen frames) to it are dropped
+MAX_PEER_BUFFER = 4 << 20
+
+# Wire format: [kind, channel length, payload length][channel][payload]
+MESSAGE_HEADER = struct.Struct("<BHI")
+PUBLISH = 0
+PUBLISH_LOSSY = 1
+SUBSCRIBE = 2
+UNSUBSCRIBE = 3
+
+Callback = Callable[[bytes], None]
+
+# Chat messages stored by any worker, as {"session_id", "message"} JSON
+MESSAGES_CHANNEL = "messages"
+
+
+def frames_channel(session_id: str) -> str:
+    """Screen frames sent by the phone of a session."""
+    return f"frames:{session_id}"
+
+
+class Broker:
+    """
+    In-process pub/sub: publish() calls the callbacks subscribed to the
+    channel right away, on the event loop. Callbacks must not block.
+
+    This process is always the hub, i.e. the one process that owns shared
+    files such as the frequent response snapshots.
+    """
+
+    shared = False
+
+    def __init__(self):
+        # Identifies this process in messages that need to skip their own origin
+        self.node_id = uuid.uuid4().hex
+        self.hub = True
+        self.subscribers: Dict[str, List[Callback]] = defaultdict(list)
+        # Called when this process becomes the hub
+        self.hub_listeners: List[Callable[[], None]] = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    def subscribe(self, channel: str, callback: Callback):
+        self.subscribers[channel].append(callback)
+
+    def unsubscribe(self, channel: str, callback: Callback):
+        callbacks = self.subscribers.get(channel)
+        if callbacks and callback in callbacks:
+            callbacks.remove(callback)
+            if not callbacks:
+                del self.subscribers[channel]
+
+    def publish(self, channel: str, payload: bytes, lossy: bool = False):
+        """
+        Delivers payload to every subscriber of channel. Lossy messages may
+        be dropped for a subscriber that can't keep up.
+        """
+        self.deliver(channel, payload)
+
+    def deliver(self, channel: str, payload: bytes):
+        for callback in list(self.subscribers.get(channel, ())):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"Error delivering message on {channel}: {str(e)}")
+
+
+class SocketBroker(Broker):
+    """
+    Pub/sub shared by several processes (uvicorn workers, or hosts) over TCP.
+    The first process to bind the address becomes the hub; the others connect
+    to it and tell it which channels they subscribe to. Every publish is
+    delivered to local subscribers directly, and routed through the hub to
+    the other processes subscribed to the channel. When the hub goes away
+    the remaining processes race to bind the address again.
+    """
+
+    shared = True
+
+    def __init__(self, address: str):
+        super().__init__()
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.hub = False
+        self.server: Optional[asyncio.AbstractServer] = None
+        # Hub only: connected processes and the channels each subscribes to
+        self.peers: Dict[asyncio.StreamWriter, Set[str]] = {}
+        # Other processes only: the connection to the hub
+        self.upstream: Optional[asyncio.StreamWriter] = None
+        self.task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task:
+            self.task.cancel()
+        if self.server:
+            self.server.close()
+        for writer in [*self.peers, *filter(None, [self.upstream])]:
+            writer.close()
+
+    def subscribe(self, channel: str, callback: Callback):
+        first = channel not in self.subscribers
+        super().subscribe(channel, callback)
+        if first and self.upstream:
+            self.send(self.upstream, encode(SUBSCRIBE, channel))
+
+    def unsubscribe(self, channel: str, callback: Callback):
+        super().unsubscribe(channel, callback)
+        if channel not in self.subscribers and self.upstream:
+            self.send(self.upstream, encode(UNSUBSCRIBE, channel))
+
+    def publish(self, channel: str, payload: bytes, lossy: bool = False):
+        self.deliver(channel, payload)
+        self.forward(channel, payload, lossy, source=None)
+
+    def forward(self, channel: str, payload: bytes, lossy: bool, source: Optional[asyncio.StreamWriter]):
+        message = encode(PUBLISH_LOSSY if lossy else PUBLISH, channel, payload)
+        if self.hub:
+            for writer, channels in self.peers.items():
+                if writer is not source and channel in channels:
+                    self.send(writer, message, lossy)
+        elif self.upstream:
+            self.send(self.upstream, message, lossy)
+
+    @staticmethod
+    def send(writer: asyncio.StreamWriter, message: bytes, lossy: bool = False):
+        if writer.is_closing():
+            return
+        # Writes only buffer; a peer that stops reading must not grow the buffer forever
+        if lossy and writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+            return
+        writer.write(message)
+
+    async def run(self):
+        while True:
+            try:
+                self.server = await asyncio.start_server(self.serve_peer, self.host, self.port)
+            except OSError:
+                self.server = None
+            if self.server:
+                self.hub = True
+                logger.info(f"Broker hub listening on {self.host}:{self.port}")
+                for listener in self.hub_listeners:
+                    listener()
+                return
+
+            try:
+                reader, self.upstream = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            logger.info(f"Connected to broker hub at {self.host}:{self.port}")
+            for channel in self.subscribers:
+                self.send(self.upstream, encode(SUBSCRIBE, channel))
+            try:
+                while True:
+                    kind, channel, payload = await read_message(reader)
+                    self.deliver(channel, payload)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning(f"Lost broker hub at {self.host}:{self.port}")
+            self.upstream.close()
+            self.upstream = None
+
+    async def serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        channels = self.peers[writer] = set()
+        try:
+            while True:
+                kind, channel, payload = await read_message(reader)
+                if kind == SUBSCRIBE:
+                    channels.add(channel)
+                elif kind == UNSUBSCRIBE:
+                    channels.discard(channel)
+                else:
+                    self.deliver(channel, payload)
+                    self.forward(channel, payload, kind == PUBLISH_LOSSY, source=writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            del self.peers[writer]
+            writer.close()
+
+
+def encode(kind: int, channel: str, payload: bytes = b"") -> bytes:
+    channel_bytes = channel.encode("utf-8")
+    return MESSAGE_HEADER.pack(kind, len(channel_bytes), len(payload)) + channel_bytes + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, str, bytes]:
+    kind, channel_length, payload_length = MESSAGE_HEADER.unpack(await reader.readexactly(MESSAGE_HEADER.size))
+    channel = (await reader.readexactly(channel_length)).decode("utf-8")
+    payload = await reader.readexactly(payload_length) if payload_length else b""
+    return kind, channel, payload
+
+
+def create_broker(address: str) -> Broker:
+    return SocketBroker(address) if address else Broker()
+
+
+# Shared by every module of this process
+broker = create_broker(BROKER_ADDRESS)
@@ -0,0 +1,329 @@
+from typing import Dict, Optional, Set, Tuple
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import mmap
+import queue
+import struct
+import threading
+import time
+from pathlib import Path
+from urllib.parse import quote
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from pubsub import broker, frames_channel
+
+
+logger = logging.getLogger(__name__)
+router = APIRouter(tags=["recording"])
+
+# 녹화 파일 경로
+RECORDINGS_DIR = Path("recordings")
+
+# Segment file: [timestamp, payload length, kind][payload] records, append-only
+RECORD_HEADER = struct.Struct("<dIB")
+# Index file: fixed-size [timestamp, segment offset] entries, one per record
+INDEX_ENTRY = struct.Struct("<dQ")
+KIND_FRAME = 0
+KIND_MESSAGE = 1
+
+# Records waiting for the writer thread; beyond this, frames are dropped rather than slowing the relay
+WRITE_QUEUE_SIZE = 256
+WRITE_BUFFER_SIZE = 1 << 20
+# Seconds between flushes of buffered records (and their index entries) to disk
+FLUSH_INTERVAL = 1.0
+# Longest pause replayed between two records, e.g. while recording was stopped
+MAX_REPLAY_GAP = 2.0
+
+
+def segment_path(session_id: str) -> Path:
+    return RECORDINGS_DIR / f"{quote(session_id, safe='')}.seg"
+
+def index_path(session_id: str) -> Path:
+    return RECORDINGS_DIR / f"{quote(session_id, safe='')}.idx"
+
+
+class SessionRecorder:
+    """세션의 화면 프레임과 채팅 메시지를 백그라운드 스레드에서 디스크에 기록합니다."""
+
+    def __init__(self, session_id: str, previous: Optional["SessionRecorder"] = None):
+        self.session_id = session_id
+        # A stopped recorder of the same session that may still be draining
+        self.previous = previous
+        self.started_at = time.time()
+        self.stats = {"frames": 0, "messages": 0, "bytes": 0, "dropped": 0, "unchanged": 0}
+        self.queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"recorder-{session_id}", daemon=True)
+        self.thread.start()
+
+    def record_frame(self, data: bytes):
+        self.enqueue(KIND_FRAME, data)
+
+    def record_message(self, message: dict):
+        self.enqueue(KIND_MESSAGE, json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+    def enqueue(self, kind: int, payload: bytes):
+        # Called on the event loop: never blocks
+        try:
+            self.queue.put_nowait((time.time(), kind, payload))
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        if self.previous is not None:
+            # Two writers appending to the same segment would corrupt the index
+            self.previous.thread.join()
+            self.previous = None
+        RECORDINGS_DIR.mkdir(parents=True, exist_ok=True)
+        with open(segment_path(self.session_id), "ab", buffering=WRITE_BUFFER_SIZE) as data_file, \
+                open(index_path(self.session_id), "ab") as index_file:
+            offset = data_file.tell()
+            pending_index = bytearray()
+            last_fingerprint = None
+            last_flush = time.monotonic()
+            while True:
+                try:
+                    item = self.queue.get(timeout=FLUSH_INTERVAL)
+                except queue.Empty:
+                    item = None
+
+                if item is not None:
+                    timestamp, kind, payload = item
+                    fingerprint = hashlib.blake2b(payload, digest_size=16).digest() if kind == KIND_FRAME else None
+                    if fingerprint is not None and fingerprint == last_fingerprint:
+                        # Replay keeps showing the previous frame, no need to store it again
+                        self.stats["unchanged"] += 1
+                    else:
+                        if fingerprint is not None:
+                            last_fingerprint = fingerprint
+                        data_file.write(RECORD_HEADER.pack(timestamp, len(payload), kind))
+                        data_file.write(payload)
+                        pending_index += INDEX_ENTRY.pack(timestamp, offset)
+                        offset += RECORD_HEADER.size + len(payload)
+                        self.stats["bytes"] += len(payload)
+                        self.stats["frames" if kind == KIND_FRAME else "messages"] += 1
+
+                # Index entries only reach disk after the records they point to
+                if pending_index and (item is None or time.monotonic() - last_flush >= FLUSH_INTERVAL):
+                    data_file.flush()
+                    index_file.write(pending_index)
+                    index_file.flush()
+                    pending_index.clear()
+                    last_flush = time.monotonic()
+
+                if item is None and self.stopping.is_set() and self.queue.empty():
+                    break
+        logger.info(f"Recording stopped: {self.session_id} {self.stats}")
+
+
+class Recording:
+    """녹화 파일을 mmap으로 열어 타임스탬프 기준으로 탐색합니다."""
+
+    def __init__(self, session_id: str):
+        # The index file is created after the data file, so it is the one that may be missing yet
+        self.index_file = open(index_path(session_id), "rb")
+        try:
+            self.data_file = open(segment_path(session_id), "rb")
+        except OSError:
+            self.index_file.close()
+            raise
+        try:
+            # The writer flushes data before the index entries pointing at it, so mapping
+            # the index first guarantees every mapped entry points inside the mapped data
+            self.index = mmap.mmap(self.index_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = mmap.mmap(self.data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            self.close()
+            raise FileNotFoundError(f"Recording is empty: {session_id}")
+        self.count = len(self.index) // INDEX_ENTRY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def entry(self, position: int) -> Tuple[float, int]:
+        return INDEX_ENTRY.unpack_from(self.index, position * INDEX_ENTRY.size)
+
+    def timestamp(self, position: int) -> float:
+        return self.entry(position)[0]
+
+    def find(self, timestamp: float) -> int:
+        """timestamp 이후 첫 레코드의 위치를 이진 탐색으로 찾습니다."""
+        return bisect.bisect_left(range(self.count), timestamp, key=self.timestamp)
+
+    def kind(self, position: int) -> int:
+        _, offset = self.entry(position)
+        return RECORD_HEADER.unpack_from(self.data, offset)[2]
+
+    def frame_before(self, position: int) -> Optional[int]:
+        """position 앞의 마지막 프레임 레코드 위치. 같은 프레임은 한 번만 저장되므로 그 시점의 화면입니다."""
+        for candidate in range(position - 1, -1, -1):
+            if self.kind(candidate) == KIND_FRAME:
+                return candidate
+        return None
+
+    def read(self, position: int) -> Tuple[float, int, bytes]:
+        _, offset = self.entry(position)
+        timestamp, length, kind = RECORD_HEADER.unpack_from(self.data, offset)
+        start = offset + RECORD_HEADER.size
+        return timestamp, kind, self.data[start:start + length]
+
+    def close(self):
+        for mapped in (getattr(self, "data", None), getattr(self, "index", None)):
+            if mapped is not None:
+                mapped.close()
+        self.data_file.close()
+        self.index_file.close()
+
+
+# 녹화 중인 세션
+recorders: Dict[str, SessionRecorder] = {}
+# Stopped recorders whose writer thread may still be draining
+stopped_recorders: Dict[str, SessionRecorder] = {}
+
+# Sessions being recorded, known to every worker; only the broker hub runs their recorders
+recording_sessions: Set[str] = set()
+# Start/stop requests, sent to every worker whichever one received the request
+RECORDING_CHANNEL = "recording"
+
+def get_recorder(session_id: str) -> Optional[SessionRecorder]:
+    return recorders.get(session_id)
+
+def start_recorder(session_id: str):
+    if session_id in recorders:
+        return
+    recorder = SessionRecorder(session_id, previous=stopped_recorders.pop(session_id, None))
+    recorders[session_id] = recorder
+    # Frames reach the recorder from whichever worker the phone is connected to
+    broker.subscribe(frames_channel(session_id), recorder.record_frame)
+    logger.info(f"Recording started: {session_id}")
+
+def stop_recorder(session_id: str) -> Optional[SessionRecorder]:
+    recorder = recorders.pop(session_id, None)
+    if recorder:
+        broker.unsubscribe(frames_channel(session_id), recorder.record_frame)
+        recorder.stop()
+        stopped_recorders[session_id] = recorder
+    return recorder
+
+def on_recording_control(payload: bytes):
+    command = json.loads(payload)
+    session_id = command["session_id"]
+    if command["action"] == "start":
+        recording_sessions.add(session_id)
+        if broker.hub:
+            start_recorder(session_id)
+    else:
+        recording_sessions.discard(session_id)
+        stop_recorder(session_id)
+
+def take_over_recordings():
+    # The previous hub's recorders are gone; keep appending to the same files
+    for session_id in recording_sessions:
+        start_recorder(session_id)
+
+broker.subscribe(RECORDING_CHANNEL, on_recording_control)
+broker.hub_listeners.append(take_over_recordings)
+
+
+@router.post("/sessions/{session_id}/recording", status_code=201)
+async def start_recording(session_id: str):
+    if session_id not in recording_sessions:
+        broker.publish(RECORDING_CHANNEL, json.dumps({"action": "start", "session_id": session_id}).encode("utf-8"))
+    return await get_recording(session_id)
+
+
+@router.delete("/sessions/{session_id}/recording")
+async def stop_recording(session_id: str):
+    if session_id not in recording_sessions:
+        raise HTTPException(status_code=404, detail="Session is not being recorded")
+    recorder = recorders.get(session_id)
+    broker.publish(RECORDING_CHANNEL, json.dumps({"action": "stop", "session_id": session_id}).encode("utf-8"))
+    # Counters are only known here if this worker is the one recording
+    return {"status": "stopped", "session_id": session_id, **(recorder.stats if recorder else {})}
+
+
+@router.get("/sessions/{session_id}/recording")
+async def get_recording(session_id: str):
+    recorder = recorders.get(session_id)
+    result = {
+        "session_id": session_id,
+        "recording": session_id in recording_sessions,
+        "stats": recorder.stats if recorder else None,
+        "records": 0,
+        "duration": 0.0
+    }
+    try:
+        recording = Recording(session_id)
+    except FileNotFoundError:
+        return result
+    try:
+        if len(recording):
+            result["records"] = len(recording)
+            result["duration"] = recording.timestamp(len(recording) - 1) - recording.timestamp(0)
+    finally:
+        recording.close()
+    return result
+
+
+@router.websocket("/ws/replay/{session_id}")
+async def websocket_replay(websocket: WebSocket, session_id: str, start: float = 0, speed: float = 1.0):
+    """
+    녹화된 세션을 첫 레코드로부터 `start`초 지점부터 재생합니다.
+    프레임은 bytes로, 채팅 메시지는 JSON 텍스트 프레임으로 보내며
+    원래 타임스탬프 간격을 `speed`로 나눈 속도로 재생합니다.
+    """
+    await websocket.accept()
+    try:
+        recording = Recording(session_id)
+    except FileNotFoundError:
+        await websocket.close(code=4404, reason="Recording not found")
+        return
+
+    speed = max(speed, 0.01)
+    try:
+        if not len(recording):
+            await websocket.send_text(json.dumps({"type": "end"}))
+            return
+        started_at = recording.timestamp(0) + max(start, 0)
+        position = recording.find(started_at)
+        previous = None
+        # Unchanged frames aren't recorded, so the screen visible at `start` is the last frame before it
+        screen = await asyncio.to_thread(recording.frame_before, position)
+        if screen is not None:
+            _, _, payload = await asyncio.to_thread(recording.read, screen)
+            await websocket.send_bytes(payload)
+            previous = started_at
+        while position < len(recording):
+            timestamp, kind, payload = await asyncio.to_thread(recording.read, position)
+            if previous is not None:
+                await asyncio.sleep(min(timestamp - previous, MAX_REPLAY_GAP) / speed)
+            previous = timestamp
+            if kind == KIND_FRAME:
+                await websocket.send_bytes(payload)
+            else:
+                await websocket.send_text(json.dumps({
+                    "type": "message",
+                    "session_id": session_id,
+                    "message": json.loads(payload)
+                }, ensure_ascii=False))
+            position += 1
+        await websocket.send_text(json.dumps({"type": "end"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        recording.close()
+
+
+@router.on_event("shutdown")
+def flush_recordings():
+    # Let writer threads drain their buffers before the process exits
+    for recorder in recorders.values():
+        recorder.stop()
+    for recorder in [*recorders.values(), *stopped_recorders.values()]:
+        recorder.thread.join(timeout=FLUSH_INTERVAL * 5)
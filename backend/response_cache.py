@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+import gzip
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+
+# Part of every ETag, so versions counted from zero again after a restart never match old ETags
+BOOT_ID = uuid.uuid4().hex
+# Serialized bodies kept for recent ETags
+MAX_CACHED_BODIES = 256
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+def make_etag(*parts: Any) -> str:
+    key = "\0".join(str(part) for part in (BOOT_ID, *parts))
+    return '"' + hashlib.blake2b(key.encode("utf-8"), digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
+
+
+def accepts_gzip(request: Request) -> bool:
+    return "gzip" in request.headers.get("accept-encoding", "")
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+class CachedBody:
+    """A response body serialized once, with a gzip copy compressed once."""
+
+    def __init__(self, raw: bytes, compresslevel: int = 6):
+        self.raw = raw
+        self.gzipped = gzip.compress(raw, compresslevel) if len(raw) >= MIN_COMPRESS_SIZE else None
+
+    def response(self, request: Request, etag: str, media_type: str) -> Response:
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if self.gzipped is not None and accepts_gzip(request):
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type=media_type, headers=headers)
+        return Response(self.raw, media_type=media_type, headers=headers)
+
+
+def serialize(content: Any) -> bytes:
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCache:
+    """
+    Conditional JSON responses for read endpoints. The caller passes an
+    ETag derived from its data version; a matching If-None-Match gets a 304
+    without building the body, and a body built for an ETag is reused
+    (raw and gzipped) until the version changes.
+    """
+
+    def __init__(self, capacity: int = MAX_CACHED_BODIES):
+        self.capacity = capacity
+        self.bodies: "OrderedDict[str, CachedBody]" = OrderedDict()
+
+    def json(self, request: Request, etag: str, build: Callable[[], Any]) -> Response:
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        body = self.bodies.get(etag)
+        if body is None:
+            body = CachedBody(serialize(build()))
+            self.bodies[etag] = body
+            while len(self.bodies) > self.capacity:
+                self.bodies.popitem(last=False)
+        else:
+            self.bodies.move_to_end(etag)
+        return body.response(request, etag, "application/json")
+
+
+def conditional_json(request: Request, etag: str, build: Callable[[], Any]) -> Response:
+    """Like ResponseCache.json, for bodies not worth keeping; compression is left to GZipMiddleware."""
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    return Response(serialize(build()), media_type="application/json", headers=headers)
+
+
+class StaticFile:
+    """A file served from memory and pre-gzipped, reloaded when its mtime or size changes."""
+
+    def __init__(self, path: Path, media_type: str):
+        self.path = path
+        self.media_type = media_type
+        self.stat_key: Optional[tuple] = None
+        self.body: Optional[CachedBody] = None
+        self.etag = ""
+
+    def response(self, request: Request) -> Response:
+        stat = os.stat(self.path)
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        if stat_key != self.stat_key:
+            raw = self.path.read_bytes()
+            self.body = CachedBody(raw, compresslevel=9)
+            self.etag = '"' + hashlib.blake2b(raw, digest_size=12).hexdigest() + '"'
+            self.stat_key = stat_key
+        if etag_matches(request, self.etag):
+            return not_modified(self.etag)
+        return self.body.response(request, self.etag, self.media_type)
@@ -0,0 +1,258 @@
+from typing import Dict, Iterable, List, Set, Tuple
+from collections import defaultdict
+import bisect
+
+# 한글 음절 = 0xAC00 + (초성 * 21 + 중성) * 28 + 종성
+HANGUL_BASE = 0xAC00
+HANGUL_LAST = 0xD7A3
+CHOSUNG = "ㄱㄲㄴㄷㄸㄹㅁㅂㅃㅅㅆㅇㅈㅉㅊㅋㅌㅍㅎ"
+JUNGSUNG = "ㅏㅐㅑㅒㅓㅔㅕㅖㅗㅘㅙㅚㅛㅜㅝㅞㅟㅠㅡㅢㅣ"
+JONGSUNG = ["", "ㄱ", "ㄲ", "ㄳ", "ㄴ", "ㄵ", "ㄶ", "ㄷ", "ㄹ", "ㄺ", "ㄻ", "ㄼ", "ㄽ", "ㄾ", "ㄿ", "ㅀ",
+            "ㅁ", "ㅂ", "ㅄ", "ㅅ", "ㅆ", "ㅇ", "ㅈ", "ㅊ", "ㅋ", "ㅌ", "ㅍ", "ㅎ"]
+# 두 번 입력해서 만드는 겹모음/겹받침은 입력 중간 상태와 맞도록 풀어 씁니다
+COMPOUND_JAMO = {
+    "ㅘ": "ㅗㅏ", "ㅙ": "ㅗㅐ", "ㅚ": "ㅗㅣ", "ㅝ": "ㅜㅓ", "ㅞ": "ㅜㅔ", "ㅟ": "ㅜㅣ", "ㅢ": "ㅡㅣ",
+    "ㄳ": "ㄱㅅ", "ㄵ": "ㄴㅈ", "ㄶ": "ㄴㅎ", "ㄺ": "ㄹㄱ", "ㄻ": "ㄹㅁ", "ㄼ": "ㄹㅂ", "ㄽ": "ㄹㅅ",
+    "ㄾ": "ㄹㅌ", "ㄿ": "ㄹㅍ", "ㅀ": "ㄹㅎ", "ㅄ": "ㅂㅅ",
+}
+CONSONANTS = set(CHOSUNG)
+
+# Match quality tiers, best first
+MATCH_PREFIX = 0
+MATCH_CONTENT = 1
+MATCH_JAMO = 2
+MATCH_CHOSUNG = 3
+MATCH_TASK = 4
+
+
+def to_jamo(text: str) -> str:
+    """공백을 없애고 한글 음절을 자모로 분해합니다. 예: '안녕' → 'ㅇㅏㄴㄴㅕㅇ'"""
+    result = []
+    for char in text.lower():
+        if char.isspace():
+            continue
+        code = ord(char)
+        if HANGUL_BASE <= code <= HANGUL_LAST:
+            index = code - HANGUL_BASE
+            result.append(CHOSUNG[index // (21 * 28)])
+            result.append(JUNGSUNG[index // 28 % 21])
+            result.append(JONGSUNG[index % 28])
+        else:
+            result.append(char)
+    return "".join(COMPOUND_JAMO.get(jamo, jamo) for jamo in "".join(result))
+
+
+def to_chosung(text: str) -> str:
+    """한글 음절을 초성으로 바꿉니다. 예: '안녕하세요' → 'ㅇㄴㅎㅅㅇ'"""
+    result = []
+    for char in text.lower():
+        if char.isspace():
+            continue
+        code = ord(char)
+        if HANGUL_BASE <= code <= HANGUL_LAST:
+            result.append(CHOSUNG[(code - HANGUL_BASE) // (21 * 28)])
+        else:
+            result.append(char)
+    return "".join(result)
+
+
+def grams(text: str) -> Set[str]:
+    """한 글자(짧은 검색어용)와 두 글자 n-gram 집합."""
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+class ResponseSearchIndex:
+    """
+    frequent responses의 내용과 task 이름을 자모/초성 n-gram 역색인으로 검색합니다.
+    결과는 일치 정도 순, 같은 일치 정도 안에서는 실제 /message 전송 횟수와 order 순입니다.
+
+    두 글자 이하의 짧은 검색어는 거의 모든 항목과 일치하므로 항목마다 문자열을
+    비교하지 않습니다. 일치 정도별 posting이 정확한 집합이 되므로, 각 단계에서
+    전송 횟수 순 목록(ranking)으로 필요한 개수만 골라냅니다. 긴 검색어는 n-gram
+    교집합으로 후보를 좁힌 뒤 문자열 비교로 확인합니다. task 이름 일치는 항목이
+    아니라 서로 다른 task 이름마다 한 번씩 확인합니다.
+    """
+
+    def __init__(self, items: Iterable[Dict] = ()):
+        # Content jamo/chosung bigrams, to narrow down candidates for long queries
+        self.postings: Dict[str, Set[str]] = defaultdict(set)
+        # (match quality, gram) -> ids; exact for queries of up to two characters
+        self.exact: Dict[Tuple[int, str], Set[str]] = defaultdict(set)
+        self.items: Dict[str, Dict] = {}
+        # id -> (content, content jamo, content chosung)
+        self.fields: Dict[str, Tuple[str, str, str]] = {}
+        self.by_content: Dict[str, Set[str]] = defaultdict(set)
+        # id -> task it was indexed under. The item dicts are shared with the caller, which
+        # changes their task before calling update(), so remove() can't go by the item.
+        self.tasks: Dict[str, str] = {}
+        # task name -> ids, and task name -> (jamo, chosung)
+        self.by_task: Dict[str, Set[str]] = defaultdict(set)
+        self.task_fields: Dict[str, Tuple[str, str]] = {}
+        self.usage: Dict[str, int] = defaultdict(int)
+        # Every id by (usage desc, order, id); rebuilt lazily after items change
+        self.ranking: List[str] = []
+        self.ranking_stale = True
+        for item in items:
+            self.add(item)
+
+    def exact_keys(self, fields: Tuple[str, str, str]) -> Set[Tuple[int, str]]:
+        content, content_jamo, content_chosung = fields
+        return (
+            {(MATCH_PREFIX, content_jamo[:1]), (MATCH_PREFIX, content_jamo[:2])}
+            | {(MATCH_CONTENT, gram) for gram in grams(content)}
+            | {(MATCH_JAMO, gram) for gram in grams(content_jamo)}
+            | {(MATCH_CHOSUNG, gram) for gram in grams(content_chosung)}
+        )
+
+    def add(self, item: Dict):
+        id = item["id"]
+        fields = (item["content"].strip().lower(), to_jamo(item["content"]), to_chosung(item["content"]))
+        self.items[id] = item
+        self.fields[id] = fields
+        for gram in grams(fields[1]) | grams(fields[2]):
+            self.postings[gram].add(id)
+        for key in self.exact_keys(fields):
+            self.exact[key].add(id)
+        self.by_content[fields[0]].add(id)
+        task = self.tasks[id] = item["taskClassification"]
+        self.by_task[task].add(id)
+        self.task_fields.setdefault(task, (to_jamo(task), to_chosung(task)))
+        self.ranking_stale = True
+
+    def remove(self, id: str):
+        fields = self.fields.pop(id, None)
+        if fields is None:
+            return
+        del self.items[id]
+        for gram in grams(fields[1]) | grams(fields[2]):
+            self.postings[gram].discard(id)
+            if not self.postings[gram]:
+                del self.postings[gram]
+        for key in self.exact_keys(fields):
+            self.exact[key].discard(id)
+            if not self.exact[key]:
+                del self.exact[key]
+        self.by_content[fields[0]].discard(id)
+        if not self.by_content[fields[0]]:
+            del self.by_content[fields[0]]
+        task = self.tasks.pop(id)
+        self.by_task[task].discard(id)
+        if not self.by_task[task]:
+            del self.by_task[task]
+            del self.task_fields[task]
+        self.usage.pop(id, None)
+        self.ranking_stale = True
+
+    def update(self, item: Dict):
+        usage = self.usage.get(item["id"], 0)
+        self.remove(item["id"])
+        self.add(item)
+        self.usage[item["id"]] = usage
+
+    def invalidate_ranking(self):
+        """order가 바뀌었을 때(재정렬 등) 호출합니다."""
+        self.ranking_stale = True
+
+    def rank_key(self, id: str) -> Tuple[int, int, str]:
+        return -self.usage.get(id, 0), self.items[id].get("order") or 0, id
+
+    def record_sent(self, text: str, count: int = 1):
+        """wizard가 보낸 메시지가 어떤 frequent response와 같으면 사용 횟수를 올립니다."""
+        content = text.strip().lower()
+        for id in self.by_content.get(content, ()):
+            if self.ranking_stale:
+                self.usage[id] += count
+                continue
+            # Moves the response up the ranking instead of sorting everything again
+            position = bisect.bisect_left(self.ranking, self.rank_key(id), key=self.rank_key)
+            if position == len(self.ranking) or self.ranking[position] != id:
+                self.usage[id] += count
+                self.ranking_stale = True
+                continue
+            self.ranking.pop(position)
+            self.usage[id] += count
+            bisect.insort(self.ranking, id, hi=position, key=self.rank_key)
+
+    def ranked(self) -> List[str]:
+        if self.ranking_stale:
+            self.ranking = sorted(self.items, key=self.rank_key)
+            self.ranking_stale = False
+        return self.ranking
+
+    def best(self, ids: Set[str], count: int) -> List[str]:
+        """ids 중 ranking 순으로 앞선 count개."""
+        # Dense sets are found quickly by walking the ranking; sparse ones are cheaper to sort
+        if len(ids) * len(ids) <= count * len(self.items):
+            return sorted(ids, key=self.rank_key)[:count]
+        result = []
+        for id in self.ranked():
+            if id in ids:
+                result.append(id)
+                if len(result) == count:
+                    break
+        return result
+
+    def content_quality(self, id: str, text: str, jamo: str, chosung_only: bool) -> int | None:
+        content, content_jamo, content_chosung = self.fields[id]
+        if content.startswith(text) or content_jamo.startswith(jamo):
+            return MATCH_PREFIX
+        if text in content:
+            return MATCH_CONTENT
+        if jamo in content_jamo:
+            return MATCH_JAMO
+        if chosung_only and jamo in content_chosung:
+            return MATCH_CHOSUNG
+        return None
+
+    def content_matches(self, text: str, jamo: str, chosung_only: bool) -> List[Set[str]]:
+        """MATCH_PREFIX..MATCH_CHOSUNG 각각에 해당하는 id 집합 (앞 단계와 겹칠 수 있음)."""
+        if len(jamo) <= 2 and len(text) <= 2:
+            # Postings hold every one- and two-character gram, so they are the exact answer
+            # (content.startswith(text) implies content_jamo.startswith(jamo), as to_jamo maps piecewise)
+            empty: Set[str] = set()
+            return [
+                self.exact.get((MATCH_PREFIX, jamo), empty),
+                self.exact.get((MATCH_CONTENT, text), empty),
+                self.exact.get((MATCH_JAMO, jamo), empty),
+                self.exact.get((MATCH_CHOSUNG, jamo), empty) if chosung_only else empty,
+            ]
+
+        postings = sorted((self.postings.get(jamo[i:i + 2], set()) for i in range(len(jamo) - 1)), key=len)
+        candidates = set(postings[0]) if postings else set()
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                break
+        matches: List[Set[str]] = [set(), set(), set(), set()]
+        for id in candidates:
+            quality = self.content_quality(id, text, jamo, chosung_only)
+            if quality is not None:
+                matches[quality].add(id)
+        return matches
+
+    def search(self, query: str, limit: int = 20, task: str | None = None) -> List[Dict]:
+        text = query.strip().lower()
+        jamo = to_jamo(query)
+        if not jamo:
+            return []
+        # 'ㅇㄴ'처럼 자음만 입력하면 초성 검색도 합니다
+        chosung_only = all(char in CONSONANTS for char in jamo)
+
+        task_matches: Set[str] = set()
+        for name, (task_jamo, task_chosung) in self.task_fields.items():
+            if jamo in task_jamo or (chosung_only and jamo in task_chosung):
+                task_matches |= self.by_task[name]
+
+        result: List[str] = []
+        matched: Set[str] = set()
+        for ids in [*self.content_matches(text, jamo, chosung_only), task_matches]:
+            if len(result) >= limit:
+                break
+            # Each item counts at the best quality it reaches
+            tier = ids - matched
+            matched |= ids
+            if task is not None:
+                tier &= self.by_task.get(task, set())
+            if tier:
+                result += self.best(tier, limit - len(result))
+        return [self.items[id] for id in result]
@@ -0,0 +1,176 @@
+from collections import OrderedDict
+from typing import Iterator, List, Optional, Tuple
+import logging
+import sqlite3
+from pathlib import Path
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite database holding every session transcript
+SESSIONS_DB = Path("sessions.db")
+# Transcripts kept in memory; the least recently used session is evicted beyond this
+HOT_SESSIONS = 64
+# Rows fetched from SQLite at a time by export_rows()
+EXPORT_BATCH = 500
+
+
+class SessionStore:
+    """
+    Session transcripts persisted in SQLite (WAL mode), with a small LRU
+    of recently used sessions in memory. Evicted sessions are loaded back
+    from disk the next time they are accessed.
+
+    Several processes may share the database: seq numbers are assigned by
+    SQLite, and sync() brings a cached transcript up to date with messages
+    appended by another process.
+    """
+
+    def __init__(self, path: Path = SESSIONS_DB, capacity: int = HOT_SESSIONS):
+        self.path = path
+        self.capacity = capacity
+        self.hot: "OrderedDict[str, list]" = OrderedDict()
+        # Autocommit: every statement is durable on its own
+        self.db = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                text TEXT NOT NULL,
+                timestamp TEXT NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID;
+        """)
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def get(self, session_id: str) -> Optional[list]:
+        """Returns the messages of a session, or None if it doesn't exist."""
+        messages = self.hot.get(session_id)
+        if messages is not None:
+            self.hot.move_to_end(session_id)
+            return messages
+
+        if self.db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is None:
+            return None
+        rows = self.db.execute(
+            "SELECT seq, role, text, timestamp FROM messages WHERE session_id = ? ORDER BY seq",
+            (session_id,)
+        )
+        messages = [
+            {"seq": seq, "role": role, "text": text, "timestamp": timestamp}
+            for seq, role, text, timestamp in rows
+        ]
+        self.cache(session_id, messages)
+        return messages
+
+    def create(self, session_id: str, created_at: str) -> list:
+        self.db.execute("INSERT OR IGNORE INTO sessions (session_id, created_at) VALUES (?, ?)", (session_id, created_at))
+        messages = []
+        self.cache(session_id, messages)
+        return messages
+
+    def append(self, session_id: str, role: str, text: str, timestamp: str) -> dict:
+        """Stores a message under the next seq of the session and returns it."""
+        # A single statement, so concurrent appends from other processes can't take the same seq
+        (seq,), = self.db.execute(
+            "INSERT INTO messages (session_id, seq, role, text, timestamp) "
+            "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, ? FROM messages WHERE session_id = ? RETURNING seq",
+            (session_id, role, text, timestamp, session_id)
+        ).fetchall()
+        message = {"seq": seq, "role": role, "text": text, "timestamp": timestamp}
+        messages = self.get(session_id)
+        if len(messages) == seq - 1:
+            messages.append(message)
+        else:
+            self.sync(session_id, seq)
+        return message
+
+    def sync(self, session_id: str, last_seq: int):
+        """Loads the messages up to `last_seq` that a cached transcript is missing."""
+        messages = self.hot.get(session_id)
+        if messages is None or len(messages) >= last_seq:
+            return
+        rows = self.db.execute(
+            "SELECT seq, role, text, timestamp FROM messages WHERE session_id = ? AND seq > ? ORDER BY seq",
+            (session_id, len(messages))
+        )
+        messages.extend(
+            {"seq": seq, "role": role, "text": text, "timestamp": timestamp}
+            for seq, role, text, timestamp in rows
+        )
+
+    def message_count(self, session_id: str) -> int:
+        messages = self.get(session_id)
+        return len(messages) if messages is not None else 0
+
+    def list_page(self, after: str = "", limit: int = 100) -> List[str]:
+        """Session ids in key order, starting after `after`."""
+        rows = self.db.execute(
+            "SELECT session_id FROM sessions WHERE session_id > ? ORDER BY session_id LIMIT ?",
+            (after, limit)
+        )
+        return [session_id for (session_id,) in rows]
+
+    def export_rows(self, start: str = "", end: str = "", batch: int = EXPORT_BATCH) -> Iterator[List[tuple]]:
+        """
+        Yields (session_id, seq, role, text, timestamp) rows in session/seq
+        order, `batch` at a time, for messages with start <= timestamp < end
+        (either bound may be empty). Reads through its own read-only
+        connection: it sees one consistent snapshot, never holds more than a
+        batch in memory, and doesn't block appends (WAL readers don't).
+        The connection may be used from a different thread for every batch.
+        """
+        conditions, params = [], []
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        try:
+            # The primary key order, so SQLite walks the table instead of sorting it
+            cursor = db.execute(
+                f"SELECT session_id, seq, role, text, timestamp FROM messages {where} ORDER BY session_id, seq",
+                params
+            )
+            while True:
+                rows = cursor.fetchmany(batch)
+                if not rows:
+                    return
+                yield rows
+        finally:
+            db.close()
+
+    def memory_usage(self) -> Tuple[int, int, int]:
+        """Sessions, messages and approximate text bytes held in memory."""
+        messages = sum(len(cached) for cached in self.hot.values())
+        size = sum(
+            len(message["text"].encode("utf-8")) + len(message["role"]) + len(message["timestamp"])
+            for cached in self.hot.values() for message in cached
+        )
+        return len(self.hot), messages, size
+
+    def cache(self, session_id: str, messages: list):
+        self.hot[session_id] = messages
+        self.hot.move_to_end(session_id)
+        while len(self.hot) > self.capacity:
+            evicted, _ = self.hot.popitem(last=False)
+            logger.debug(f"Session evicted from memory: {evicted}")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,141 @@
+# Per-frame CPU cost of the frame transcoding in frame_transcoder.py (needs Pillow).
+#
+#   python transcode_benchmark.py                       # synthetic 1080x2400 phone screens
+#   python transcode_benchmark.py screen1.jpg screen2.png --frames 100 --output results.json
+#
+# Every frame is re-encoded at each level of QUALITY_LEVELS, one at a time,
+# and the CPU time of each call is measured on its thread. The same frames
+# are then run through the transcoding pool, to show the throughput all
+# TRANSCODE_WORKERS threads reach together.
+from typing import Dict, List
+import argparse
+import io
+import json
+import random
+import sys
+import time
+from pathlib import Path
+import frame_transcoder
+from frame_transcoder import QUALITY_LEVELS, TRANSCODE_WORKERS, pool, timed_transcode
+
+
+# Size of the synthetic screens: a common phone resolution, in portrait
+SCREEN_SIZE = (1080, 2400)
+# JPEG quality the synthetic screens are encoded at, like a phone's screen capture upload
+SOURCE_QUALITY = 90
+
+
+def synthetic_screens(count: int, source_format: str) -> List[bytes]:
+    """App-like screens: a status bar, text rows, buttons and a photo-like block, different every frame."""
+    from PIL import Image, ImageDraw, ImageFilter
+
+    rng = random.Random(0)
+    width, height = SCREEN_SIZE
+    frames = []
+    for _ in range(count):
+        image = Image.new("RGB", SCREEN_SIZE, (250, 250, 250))
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, width, 80), fill=(30, 30, 30))
+        y = 120
+        while y < height - 200:
+            if rng.random() < 0.15:
+                # Photo-like content compresses the worst
+                photo = Image.merge("RGB", [
+                    Image.effect_noise((width - 80, 400), rng.uniform(40, 90)).filter(ImageFilter.GaussianBlur(3))
+                    for _ in range(3)
+                ])
+                image.paste(photo, (40, y))
+                y += 440
+            elif rng.random() < 0.3:
+                draw.rounded_rectangle((40, y, width - 40, y + 110), 24, fill=(rng.randrange(256), rng.randrange(256), 200))
+                y += 150
+            else:
+                text = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz  ") for _ in range(60))
+                draw.text((40, y), text, fill=(20, 20, 20), font_size=36)
+                y += 60
+        output = io.BytesIO()
+        if source_format == "png":
+            image.save(output, "PNG")
+        else:
+            image.save(output, "JPEG", quality=SOURCE_QUALITY)
+        frames.append(output.getvalue())
+    return frames
+
+
+def percentile(values: List[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+
+def benchmark_level(frames: List[bytes], max_side: int, quality: int) -> Dict:
+    cpu_ms, sizes = [], []
+    for frame in frames:
+        encoded, cpu_seconds = timed_transcode(frame, max_side, quality)
+        cpu_ms.append(cpu_seconds * 1000)
+        sizes.append(len(encoded))
+
+    # The same work spread over the transcoding pool
+    started = time.perf_counter()
+    list(pool.map(timed_transcode, frames, [max_side] * len(frames), [quality] * len(frames)))
+    pool_seconds = time.perf_counter() - started
+
+    source_bytes = sum(len(frame) for frame in frames)
+    return {
+        "size": max_side,
+        "quality": quality,
+        "source_kb": round(source_bytes / len(frames) / 1024, 1),
+        "output_kb": round(sum(sizes) / len(sizes) / 1024, 1),
+        "bytes_saved": round(1 - sum(sizes) / source_bytes, 3),
+        "cpu_ms": {
+            "mean": round(sum(cpu_ms) / len(cpu_ms), 2),
+            "p50": round(percentile(cpu_ms, 50), 2),
+            "p95": round(percentile(cpu_ms, 95), 2),
+        },
+        "frames_per_cpu_second": round(len(cpu_ms) / (sum(cpu_ms) / 1000), 1),
+        "pool_frames_per_second": round(len(frames) / pool_seconds, 1),
+    }
+
+
+def print_report(results: Dict):
+    print(f"{results['frames']} frames, {results['source']}, pool of {results['workers']} threads")
+    print(f"{'level':>12} {'source KB':>10} {'output KB':>10} {'saved':>6} {'cpu ms p50':>11} {'p95':>7} {'frames/cpu s':>13} {'pool frames/s':>14}")
+    for level in results["levels"]:
+        print(f"{level['size']:>6}px q{level['quality']:<3} {level['source_kb']:>10} {level['output_kb']:>10} "
+              f"{level['bytes_saved']:>6.0%} {level['cpu_ms']['p50']:>11} {level['cpu_ms']['p95']:>7} "
+              f"{level['frames_per_cpu_second']:>13} {level['pool_frames_per_second']:>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-frame CPU cost of frame transcoding")
+    parser.add_argument("images", nargs="*", type=Path, help="screen captures to use instead of synthetic screens")
+    parser.add_argument("--frames", type=int, default=40, help="frames per level (images are repeated as needed)")
+    parser.add_argument("--source-format", choices=["jpeg", "png"], default="jpeg", help="encoding of the synthetic screens")
+    parser.add_argument("--output", type=Path, help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if not frame_transcoder.available:
+        sys.exit("Pillow is not installed: pip install pillow")
+
+    if args.images:
+        images = [path.read_bytes() for path in args.images]
+        frames = [images[i % len(images)] for i in range(args.frames)]
+        source = ", ".join(path.name for path in args.images)
+    else:
+        frames = synthetic_screens(args.frames, args.source_format)
+        source = f"synthetic {SCREEN_SIZE[0]}x{SCREEN_SIZE[1]} {args.source_format}"
+
+    # Warms up the pool threads and Pillow's codecs
+    benchmark_level(frames[:TRANSCODE_WORKERS], *QUALITY_LEVELS[-1])
+    results = {
+        "frames": len(frames),
+        "source": source,
+        "workers": TRANSCODE_WORKERS,
+        "levels": [benchmark_level(frames, max_side, quality) for max_side, quality in QUALITY_LEVELS],
+    }
+    print_report(results)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
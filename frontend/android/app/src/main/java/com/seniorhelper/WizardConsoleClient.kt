@@ -21,15 +21,17 @@ class WizardConsoleClient(
         .connectTimeout(10, TimeUnit.SECONDS)
         .readTimeout(10, TimeUnit.SECONDS)
         .writeTimeout(10, TimeUnit.SECONDS)
+        .pingInterval(20, TimeUnit.SECONDS)
         .build()
     
     private val handler = Handler(Looper.getMainLooper())
-    private var isPolling = false
-    private var lastMessageCount = 0
+    private var isListening = false
+    private var messageSocket: WebSocket? = null
+    private var lastSeq = 0
     
     companion object {
         private const val TAG = "WizardConsoleClient"
-        private const val POLL_INTERVAL = 2000L // Poll every 2 seconds
+        private const val RECONNECT_DELAY = 2000L // Retry delay after the message stream drops
     }
     
     fun connect() {
@@ -38,8 +40,8 @@ class WizardConsoleClient(
         // Test connection
         testConnection()
         
-        // Start polling for new messages
-        startPolling()
+        // Subscribe to pushed messages
+        startListening()
     }
     
     private fun testConnection() {
@@ -68,73 +70,62 @@ class WizardConsoleClient(
         })
     }
     
-    private fun startPolling() {
-        if (isPolling) return
-        isPolling = true
-        pollForMessages()
+    private fun startListening() {
+        if (isListening) return
+        isListening = true
+        openMessageStream()
     }
     
-    private fun pollForMessages() {
-        if (!isPolling) return
+    private fun openMessageStream() {
+        if (!isListening) return
         
+        // http(s)://host -> ws(s)://host; resume after the last message we delivered
+        val wsUrl = serverUrl.replaceFirst("http", "ws")
         val request = Request.Builder()
-            .url("$serverUrl/sessions/$sessionId")
-            .get()
+            .url("$wsUrl/ws/messages/$sessionId?since=$lastSeq")
             .build()
         
-        client.newCall(request).enqueue(object : Callback {
-            override fun onFailure(call: Call, e: IOException) {
-                Log.e(TAG, "Polling failed: ${e.message}")
-                // Continue polling even on failure
-                handler.postDelayed({ pollForMessages() }, POLL_INTERVAL)
-            }
-            
-            override fun onResponse(call: Call, response: Response) {
+        messageSocket = client.newWebSocket(request, object : WebSocketListener() {
+            override fun onMessage(webSocket: WebSocket, text: String) {
                 try {
-                    if (response.isSuccessful) {
-                        val body = response.body?.string()
-                        if (body != null) {
-                            try {
-                                val json = JSONObject(body)
-                                val messages = json.getJSONArray("messages")
-                                
-                                // Check if there are new messages
-                                val messageCount = messages.length()
-                                if (messageCount > lastMessageCount) {
-                                    // Process new messages
-                                    for (i in lastMessageCount until messageCount) {
-                                        val message = messages.getJSONObject(i)
-                                        val role = message.getString("role")
-                                        val text = message.getString("text")
-                                        
-                                        // Only notify if it's from wizard/assistant
-                                        if (role == "wizard" || role == "assistant") {
-                                            handler.post {
-                                                onMessageReceived(text)
-                                            }
-                                        }
-                                    }
-                                    lastMessageCount = messageCount
-                                }
-                            } catch (e: Exception) {
-                                Log.e(TAG, "Error parsing messages: ${e.message}", e)
-                            }
+                    val json = JSONObject(text)
+                    if (json.optString("type") != "message") return
+                    val message = json.getJSONObject("message")
+                    val seq = message.getInt("seq")
+                    if (seq <= lastSeq) return
+                    lastSeq = seq
+                    
+                    val role = message.getString("role")
+                    val messageText = message.getString("text")
+                    
+                    // Only notify if it's from wizard/assistant
+                    if (role == "wizard" || role == "assistant") {
+                        handler.post {
+                            onMessageReceived(messageText)
                         }
-                    } else if (response.code == 404) {
-                        // Session doesn't exist yet, that's okay
-                        Log.d(TAG, "Session not found yet, will be created on first message")
-                    } else {
-                        Log.w(TAG, "Unexpected response code: ${response.code}")
                     }
-                } finally {
-                    response.close()
-                    // Continue polling
-                    handler.postDelayed({ pollForMessages() }, POLL_INTERVAL)
+                } catch (e: Exception) {
+                    Log.e(TAG, "Error parsing message: ${e.message}", e)
                 }
             }
+            
+            override fun onClosed(webSocket: WebSocket, code: Int, reason: String) {
+                Log.d(TAG, "Message stream closed: $code $reason")
+                scheduleReconnect(webSocket)
+            }
+            
+            override fun onFailure(webSocket: WebSocket, t: Throwable, response: Response?) {
+                Log.e(TAG, "Message stream failed: ${t.message}")
+                scheduleReconnect(webSocket)
+            }
         })
     }
     
+    private fun scheduleReconnect(webSocket: WebSocket) {
+        if (webSocket !== messageSocket) return
+        handler.postDelayed({ openMessageStream() }, RECONNECT_DELAY)
+    }
+    
     fun sendMessage(message: String) {
         val json = JSONObject().apply {
             put("session_id", sessionId)
@@ -169,7 +160,9 @@ class WizardConsoleClient(
     }
     
     fun disconnect() {
-        isPolling = false
+        isListening = false
+        messageSocket?.close(1000, "disconnect")
+        messageSocket = null
         handler.removeCallbacksAndMessages(null)
         handler.post {
             onConnectionStatusChanged(false)
@@ -178,6 +171,6 @@ class WizardConsoleClient(
     }
     
     fun isConnected(): Boolean {
-        return isPolling
+        return isListening
     }
 }
\ No newline at end of file
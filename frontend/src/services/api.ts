@@ -14,10 +14,17 @@ export interface LogRequest {
   session_id: string;
   event_type: string;
   event_data?: Record<string, any>;
+  timestamp?: string;
 }
 
 const API_BASE_URL = 'http://143.248.57.111:8000';
 
+// UI events are buffered and sent together to /log/batch
+const LOG_BATCH_SIZE = 20;
+const LOG_FLUSH_INTERVAL_MS = 2000;
+let pendingEvents: LogRequest[] = [];
+let flushTimer: ReturnType<typeof setTimeout> | null = null;
+
 export const sendMessage = async (
   sessionId: string,
   role: string,
@@ -52,19 +59,40 @@ export const logEvent = async (
   eventType: string,
   eventData?: Record<string, any>
 ): Promise<void> => {
+  pendingEvents.push({
+    session_id: sessionId,
+    event_type: eventType,
+    event_data: eventData,
+    timestamp: new Date().toISOString(),
+  });
+
+  if (pendingEvents.length >= LOG_BATCH_SIZE) {
+    await flushEvents();
+  } else if (!flushTimer) {
+    flushTimer = setTimeout(flushEvents, LOG_FLUSH_INTERVAL_MS);
+  }
+};
+
+export const flushEvents = async (): Promise<void> => {
+  if (flushTimer) {
+    clearTimeout(flushTimer);
+    flushTimer = null;
+  }
+  if (pendingEvents.length === 0) {
+    return;
+  }
+
+  const events = pendingEvents;
+  pendingEvents = [];
   try {
-    await fetch(`${API_BASE_URL}/log`, {
+    await fetch(`${API_BASE_URL}/log/batch`, {
       method: 'POST',
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({
-        session_id: sessionId,
-        event_type: eventType,
-        event_data: eventData,
-      }),
+      body: JSON.stringify(events),
     });
   } catch (error) {
-    console.error('Error logging event:', error);
+    console.error('Error logging events:', error);
   }
 };
\ No newline at end of file